@@ -0,0 +1,152 @@
+# Shared code of the action plugins for the Gogs modules (gogs_user,
+# gogs_project, gogs_org, gogs_ready), which run the modules inside the
+# Ansible controller process.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import os
+import sys
+
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+import ansible.module_utils
+from ansible.module_utils import basic
+from ansible.plugins.action import ActionBase
+
+try:
+  from ansible.vars.clean import remove_internal_keys
+except ImportError:
+  remove_internal_keys = None
+
+try:
+  from ansible.utils.unsafe_proxy import wrap_var
+except ImportError:
+  wrap_var = None
+
+
+ANSIBLE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules loaded into this process, by name
+_modules = {}
+
+
+def load_source(name, path):
+  try:
+    from importlib.util import module_from_spec, spec_from_file_location
+  except ImportError:
+    import imp
+    return imp.load_source(name, path)
+  spec = spec_from_file_location(name, path)
+  module = module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+def load_module(name):
+  """
+  Import the module `name` from the library directory next to this one, with
+  the module_utils directory next to it added to ansible.module_utils.
+  """
+  if name not in _modules:
+    module_utils = os.path.join(ANSIBLE_DIR, "module_utils")
+    if module_utils not in ansible.module_utils.__path__:
+      ansible.module_utils.__path__.append(module_utils)
+    _modules[name] = load_source("gogs_inprocess_" + name,
+      os.path.join(ANSIBLE_DIR, "library", name + ".py"))
+  return _modules[name]
+
+
+def parse_module_output(output, rc):
+  """
+  Decode the result a module printed, like ActionBase._parse_returned_data
+  (whose signature changes between Ansible versions) does for module output.
+  """
+  start = output.find("{")
+  try:
+    if start < 0:
+      raise ValueError("no JSON object")
+    data = json.loads(output[start:])
+    if not isinstance(data, dict):
+      raise ValueError("not a JSON object")
+  except ValueError:
+    return {"failed": True, "msg": "MODULE FAILURE", "module_stdout": output,
+      "rc": rc, "_ansible_parsed": False}
+  data["_ansible_parsed"] = True
+  return data
+
+
+class GogsActionModule(ActionBase):
+  """
+  Runs the module named in MODULE in-process if the task runs on the
+  controller (e.g. with local_action). This saves building, transferring and
+  unpacking the module payload and starting a Python interpreter, per task
+  and loop item. Tasks on other hosts, or using become, async or environment
+  (which only applies to a separate module process, e.g. GIT_SSH_COMMAND for
+  seed_source, or http_proxy, which GogsClient reads from the environment),
+  execute the module as usual.
+  """
+  TRANSFERS_FILES = False
+  MODULE = None
+
+  def run(self, tmp=None, task_vars=None):
+    if task_vars is None:
+      task_vars = dict()
+    result = super(GogsActionModule, self).run(tmp, task_vars)
+    del tmp
+
+    if self._connection.transport not in ("local", "ansible.builtin.local") or \
+        self._play_context.become or getattr(self._task, "async_val", None) or \
+        any(self._task.environment or ()):
+      result.update(self._execute_module(module_name=self.MODULE,
+        task_vars=task_vars))
+      return result
+
+    module_args = dict(self._task.args)
+    if hasattr(self, "_update_module_args"):
+      self._update_module_args(self.MODULE, module_args, task_vars)
+    result.update(self._run_in_process(module_args))
+    return result
+
+  def _run_in_process(self, module_args):
+    """
+    Run the module's main() with `module_args`, and return its result like
+    _execute_module does. AnsibleModule reads its arguments from
+    basic._ANSIBLE_ARGS (instead of stdin) and prints its result before it
+    exits, so we capture stdout and catch SystemExit.
+    """
+    module = load_module(self.MODULE)
+    basic._ANSIBLE_ARGS = json.dumps({"ANSIBLE_MODULE_ARGS": module_args}) \
+      .encode("utf-8")
+    # since Ansible 2.19, the result is encoded according to a serialization
+    # profile; "legacy" is the one used for modules by default
+    if hasattr(basic, "_ANSIBLE_PROFILE"):
+      basic._ANSIBLE_PROFILE = "legacy"
+    stdout, sys.stdout = sys.stdout, StringIO()
+    rc = 0
+    try:
+      module.main()
+    except SystemExit as e:
+      rc = e.code or 0
+    except Exception as e:
+      sys.stdout.write('{"failed": true, "msg": %s}' %
+        json.dumps("MODULE FAILURE: %s: %s" % (type(e).__name__, e)))
+      rc = 1
+    finally:
+      output, sys.stdout = sys.stdout.getvalue(), stdout
+      basic._ANSIBLE_ARGS = None
+      if hasattr(basic, "_ANSIBLE_PROFILE"):
+        basic._ANSIBLE_PROFILE = None
+
+    data = parse_module_output(output, rc)
+    if remove_internal_keys is not None:
+      remove_internal_keys(data)
+    else:
+      self._remove_internal_keys(data)
+    if wrap_var is not None:
+      data = wrap_var(data)
+    return data
@@ -0,0 +1,15 @@
+# Runs the gogs_user module inside the Ansible controller process for tasks on
+# the controller (see gogs_inprocess).
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gogs_inprocess import GogsActionModule
+
+
+class ActionModule(GogsActionModule):
+  MODULE = "gogs_user"
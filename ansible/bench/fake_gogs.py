@@ -0,0 +1,660 @@
+#!/usr/bin/env python
+"""
+Stand-in for the parts of the Gogs API used by the gogs_* modules.
+
+Keeps all state in memory and counts the requests it receives (per endpoint),
+so it can be used to test the modules and to measure how many requests they
+need, without a real Gogs server. Per-request latency, random errors, a number
+of workers (requests beyond that wait for a free worker, so latency grows with
+load) and a concurrency limit (beyond which requests fail like an overloaded
+server behind nginx) can be configured to mimic a slow server.
+
+Besides the Gogs API, the server answers
+  GET /_stats   request/connection counters
+  POST /_reset  clear all state and counters
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+  from urllib import unquote
+  from urlparse import parse_qs, urlparse
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+  from urllib.parse import parse_qs, unquote, urlparse
+
+
+# Gogs caps the number of search results at [ui] EXPLORE_PAGING_NUM, which is
+# 20 by default
+SEARCH_LIMIT = 20
+
+
+class NotFound(Exception):
+  pass
+
+
+class ApiError(Exception):
+  def __init__(self, status, message):
+    Exception.__init__(self, message)
+    self.status = status
+    self.message = message
+
+
+class FakeGogs(object):
+  """
+  In-memory Gogs state and API routes. All methods must be called with `lock`
+  held.
+  """
+
+  def __init__(self, admin="admin", search_limit=SEARCH_LIMIT):
+    self.lock = threading.Lock()
+    self.admin = admin
+    self.search_limit = search_limit
+    self.reset()
+
+  def reset(self):
+    self.next_id = 0
+    self.clock = 0
+    self.users = {}
+    self.keys = {}
+    self.repos = {}
+    self.deploy_keys = {}
+    # keys of projects whose migration is still running
+    self.migrating = set()
+    # organizations are users as well (in self.users); these are their names
+    self.orgs = set()
+    self.teams = {}
+    # collaborators of projects, by project key: {username: permission}
+    self.collaborators = {}
+    self.requests = {}
+    self.connections = 0
+    self.errors = 0
+    self.add_user(self.admin, "%s@localhost" % self.admin)
+
+  def new_id(self):
+    self.next_id += 1
+    return self.next_id
+
+  def timestamp(self):
+    # strictly increasing, so updates are always visible in updated_at
+    self.clock = max(int(time.time()), self.clock + 1)
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.clock))
+
+  def add_user(self, username, email):
+    if username.lower() in self.users:
+      raise ApiError(422, "user already exists [name: %s]" % username)
+    user = {"id": self.new_id(), "username": username, "login": username,
+      "full_name": "", "email": email, "avatar_url": ""}
+    self.users[username.lower()] = user
+    return user
+
+  def user(self, username):
+    try:
+      return self.users[username.lower()]
+    except KeyError:
+      raise NotFound()
+
+  def repo(self, owner, name):
+    try:
+      return self.repos[(owner.lower(), name.lower())]
+    except KeyError:
+      raise NotFound()
+
+  def add_repo(self, owner, body, mirror=False):
+    owner = self.user(owner)
+    name = body.get("name") or body.get("repo_name")
+    key = (owner["username"].lower(), name.lower())
+    if key in self.repos:
+      raise ApiError(422, "repository already exists [uname: %s, name: %s]" %
+        (owner["username"], name))
+    now = self.timestamp()
+    repo = {"id": self.new_id(), "owner": owner, "name": name,
+      "full_name": owner["username"] + "/" + name,
+      "ssh_url": "git@localhost:%s/%s.git" % (owner["username"], name),
+      "description": body.get("description", ""),
+      "private": bool(body.get("private")), "mirror": mirror,
+      "empty": not body.get("auto_init") and not mirror,
+      "created_at": now, "updated_at": now}
+    self.repos[key] = repo
+    return repo
+
+  def add_key(self, store, owner, body):
+    fields = body["key"].split()
+    for key in list(self.keys.values()) + list(self.deploy_keys.values()):
+      if key["key"].split()[:2] == fields[:2]:
+        raise ApiError(422, "public key already exists")
+    key = {"id": self.new_id(), "key": " ".join(fields[:2]),
+      "title": body["title"], "owner": owner}
+    store[key["id"]] = key
+    return key
+
+  @staticmethod
+  def public_key(key):
+    return dict((k, v) for k, v in key.items() if k != "owner")
+
+  def route(self, method, path, query, body):
+    """
+    Returns a tuple (endpoint, status, response), where `endpoint` is the
+    path template used for the request statistics.
+    """
+    routes = [
+      ("GET", "user", self.get_own_user),
+      ("GET", "users/search", self.search_users),
+      ("GET", "users/:username", self.get_user),
+      ("GET", "users/:username/keys", self.get_user_keys),
+      ("GET", "users/:username/repos", self.get_user_repos),
+      ("POST", "admin/users", self.create_user),
+      ("PATCH", "admin/users/:username", self.edit_user),
+      ("DELETE", "admin/users/:username", self.delete_user),
+      ("POST", "admin/users/:username/keys", self.create_user_key),
+      ("POST", "admin/users/:username/repos", self.create_user_repo),
+      ("DELETE", "user/keys/:id", self.delete_own_key),
+      ("POST", "user/repos", self.create_own_repo),
+      ("POST", "org/:org/repos", self.create_user_repo),
+      ("GET", "orgs/:org", self.get_org),
+      ("PATCH", "orgs/:org", self.edit_org),
+      ("POST", "admin/users/:username/orgs", self.create_org),
+      ("GET", "orgs/:org/teams", self.get_teams),
+      ("POST", "admin/orgs/:org/teams", self.create_team),
+      ("GET", "admin/teams/:id/members", self.get_team_members),
+      ("PUT", "admin/teams/:id/members/:username", self.add_team_member),
+      ("DELETE", "admin/teams/:id/members/:username", self.remove_team_member),
+      ("PUT", "admin/teams/:id/repos/:repo", self.add_team_repo),
+      ("DELETE", "admin/teams/:id/repos/:repo", self.remove_team_repo),
+      ("GET", "repos/:owner/:repo/collaborators", self.get_collaborators),
+      ("PUT", "repos/:owner/:repo/collaborators/:username", self.add_collaborator),
+      ("DELETE", "repos/:owner/:repo/collaborators/:username", self.delete_collaborator),
+      ("POST", "repos/migrate", self.migrate_repo),
+      ("GET", "repos/:owner/:repo", self.get_repo),
+      ("DELETE", "repos/:owner/:repo", self.delete_repo),
+      ("GET", "repos/:owner/:repo/branches", self.get_branches),
+      ("POST", "repos/:owner/:repo/mirror-sync", self.mirror_sync),
+      ("GET", "repos/:owner/:repo/keys", self.get_deploy_keys),
+      ("POST", "repos/:owner/:repo/keys", self.create_deploy_key),
+      ("DELETE", "repos/:owner/:repo/keys/:id", self.delete_deploy_key),
+    ]
+    parts = path.split("/")
+    for route_method, template, handler in routes:
+      template_parts = template.split("/")
+      if route_method != method or len(template_parts) != len(parts):
+        continue
+      args = []
+      for template_part, part in zip(template_parts, parts):
+        if template_part.startswith(":"):
+          args.append(unquote(part))
+        elif template_part != part:
+          break
+      else:
+        endpoint = method + " " + template
+        try:
+          status, response = handler(query, body, *args)
+        except NotFound:
+          status, response = 404, None
+        except ApiError as e:
+          status, response = e.status, {"message": e.message}
+        return endpoint, status, response
+    return method + " ?", 404, None
+
+  def search_users(self, query, body):
+    keyword = query.get("q", [""])[0].lower()
+    limit = min(int(query.get("limit", ["10"])[0]), self.search_limit)
+    # like Gogs, ignore the page parameter
+    data = [user for name, user in sorted(self.users.items())
+      if keyword and name not in self.orgs and
+        (keyword in name or keyword in user["full_name"].lower())]
+    return 200, {"ok": True, "data": data[:limit]}
+
+  def get_user(self, query, body, username):
+    return 200, self.user(username)
+
+  def get_own_user(self, query, body):
+    return 200, self.user(self.admin)
+
+  def get_user_keys(self, query, body, username):
+    user = self.user(username)
+    return 200, [self.public_key(key) for key in self.keys.values()
+      if key["owner"] == user["id"]]
+
+  def get_user_repos(self, query, body, username):
+    user = self.user(username)
+    return 200, [repo for repo in self.repos.values() if repo["owner"] is user]
+
+  def create_user(self, query, body):
+    return 201, self.add_user(body["username"], body["email"])
+
+  def edit_user(self, query, body, username):
+    user = self.user(username)
+    if not body.get("email"):
+      raise ApiError(422, "Email: Required")
+    for param in ("email", "full_name"):
+      if param in body:
+        user[param] = body[param]
+    return 200, user
+
+  def delete_user(self, query, body, username):
+    user = self.user(username)
+    if any(repo["owner"] is user for repo in self.repos.values()):
+      raise ApiError(422, "user still has ownership of repositories")
+    for key in [key for key in self.keys.values() if key["owner"] == user["id"]]:
+      del self.keys[key["id"]]
+    for team in self.teams.values():
+      team["members"].discard(user["id"])
+    for collaborators in self.collaborators.values():
+      collaborators.pop(username.lower(), None)
+    del self.users[username.lower()]
+    return 204, None
+
+  def create_user_key(self, query, body, username):
+    user = self.user(username)
+    return 201, self.public_key(self.add_key(self.keys, user["id"], body))
+
+  def delete_own_key(self, query, body, key_id):
+    key = self.keys.get(int(key_id))
+    if key is None or key["owner"] != self.user(self.admin)["id"]:
+      raise NotFound()
+    del self.keys[key["id"]]
+    return 204, None
+
+  def create_user_repo(self, query, body, owner):
+    return 201, self.add_repo(owner, body)
+
+  def create_own_repo(self, query, body):
+    return 201, self.add_repo(self.admin, body)
+
+  def migrate_repo(self, query, body):
+    # like Gogs, only accept the numeric id of the owner
+    owner = [user for user in self.users.values() if user["id"] == body.get("uid")]
+    if not owner:
+      raise ApiError(422, "user does not exist")
+    repo = self.add_repo(owner[0]["username"], body, mirror=bool(body.get("mirror")))
+    # the project exists (empty) while the repository is cloned, see
+    # finish_migration
+    self.migrating.add((repo["owner"]["username"].lower(), repo["name"].lower()))
+    return 201, repo
+
+  def finish_migration(self, repo, clone_addr):
+    key = (repo["owner"]["username"].lower(), repo["name"].lower())
+    self.migrating.discard(key)
+    if "fail" in clone_addr:
+      # like Gogs, delete the project again if the clone fails
+      self.repos.pop(key, None)
+      return 500, {"message": "clone: exit status 128"}
+    repo["empty"] = False
+    repo["updated_at"] = self.timestamp()
+    return 201, repo
+
+  def get_branches(self, query, body, owner, name):
+    repo = self.repo(owner, name)
+    if repo["empty"] or (owner.lower(), name.lower()) in self.migrating:
+      return 200, []
+    return 200, [{"name": "master", "commit": {"id": "%040x" % repo["id"]}}]
+
+  def get_repo(self, query, body, owner, name):
+    return 200, self.repo(owner, name)
+
+  def delete_repo(self, query, body, owner, name):
+    repo = self.repo(owner, name)
+    for key in [key for key in self.deploy_keys.values() if key["owner"] == repo["id"]]:
+      del self.deploy_keys[key["id"]]
+    for team in self.teams.values():
+      team["repos"].discard(repo["id"])
+    self.collaborators.pop((owner.lower(), name.lower()), None)
+    del self.repos[(owner.lower(), name.lower())]
+    return 204, None
+
+  def org(self, name):
+    if name.lower() not in self.orgs:
+      raise NotFound()
+    return self.users[name.lower()]
+
+  def team(self, team_id):
+    try:
+      return self.teams[int(team_id)]
+    except (KeyError, ValueError):
+      raise NotFound()
+
+  def add_team(self, org, name, description="", permission="read"):
+    if any(team["org"] == org["id"] and team["name"].lower() == name.lower()
+        for team in self.teams.values()):
+      raise ApiError(422, "team already exists [name: %s]" % name)
+    team = {"id": self.new_id(), "name": name, "description": description,
+      "permission": permission, "org": org["id"], "members": set(), "repos": set()}
+    self.teams[team["id"]] = team
+    return team
+
+  @staticmethod
+  def public_team(team):
+    return dict((k, team[k]) for k in ("id", "name", "description", "permission"))
+
+  def get_org(self, query, body, name):
+    return 200, self.org(name)
+
+  def create_org(self, query, body, username):
+    user = self.user(username)
+    org = self.add_user(body["username"], "")
+    for param in ("full_name", "description", "website", "location"):
+      org[param] = body.get(param, "")
+    self.orgs.add(org["username"].lower())
+    # like Gogs, the creator becomes a member of the Owners team
+    self.add_team(org, "Owners", permission="owner")["members"].add(user["id"])
+    return 201, org
+
+  def edit_org(self, query, body, name):
+    org = self.org(name)
+    for param in ("full_name", "description", "website", "location"):
+      if param in body:
+        org[param] = body[param]
+    return 200, org
+
+  def get_teams(self, query, body, name):
+    org = self.org(name)
+    return 200, [self.public_team(team) for team in self.teams.values()
+      if team["org"] == org["id"]]
+
+  def create_team(self, query, body, name):
+    team = self.add_team(self.org(name), body["name"], body.get("description", ""),
+      body.get("permission", "read"))
+    return 201, self.public_team(team)
+
+  def get_team_members(self, query, body, team_id):
+    team = self.team(team_id)
+    return 200, [user for user in self.users.values() if user["id"] in team["members"]]
+
+  def add_team_member(self, query, body, team_id, username):
+    self.team(team_id)["members"].add(self.user(username)["id"])
+    return 204, None
+
+  def remove_team_member(self, query, body, team_id, username):
+    self.team(team_id)["members"].discard(self.user(username)["id"])
+    return 204, None
+
+  def add_team_repo(self, query, body, team_id, name):
+    team = self.team(team_id)
+    org = [user for user in self.users.values() if user["id"] == team["org"]][0]
+    team["repos"].add(self.repo(org["username"], name)["id"])
+    return 204, None
+
+  def remove_team_repo(self, query, body, team_id, name):
+    team = self.team(team_id)
+    org = [user for user in self.users.values() if user["id"] == team["org"]][0]
+    team["repos"].discard(self.repo(org["username"], name)["id"])
+    return 204, None
+
+  def get_collaborators(self, query, body, owner, name):
+    self.repo(owner, name)
+    collaborators = self.collaborators.get((owner.lower(), name.lower()), {})
+    return 200, [dict(self.user(username), permissions={
+      "admin": permission == "admin", "push": permission in ("admin", "write"),
+      "pull": True}) for username, permission in sorted(collaborators.items())]
+
+  def add_collaborator(self, query, body, owner, name, username):
+    self.repo(owner, name)
+    user = self.user(username)
+    self.collaborators.setdefault((owner.lower(), name.lower()), {})[
+      user["username"].lower()] = (body or {}).get("permission", "write")
+    return 204, None
+
+  def delete_collaborator(self, query, body, owner, name, username):
+    self.repo(owner, name)
+    self.collaborators.get((owner.lower(), name.lower()), {}).pop(username.lower(), None)
+    return 204, None
+
+  def mirror_sync(self, query, body, owner, name):
+    repo = self.repo(owner, name)
+    if not repo["mirror"]:
+      raise NotFound()
+    repo["updated_at"] = self.timestamp()
+    return 202, None
+
+  def get_deploy_keys(self, query, body, owner, name):
+    repo = self.repo(owner, name)
+    return 200, [self.public_key(key) for key in self.deploy_keys.values()
+      if key["owner"] == repo["id"]]
+
+  def create_deploy_key(self, query, body, owner, name):
+    repo = self.repo(owner, name)
+    return 201, self.public_key(self.add_key(self.deploy_keys, repo["id"], body))
+
+  def delete_deploy_key(self, query, body, owner, name, key_id):
+    repo = self.repo(owner, name)
+    key = self.deploy_keys.get(int(key_id))
+    if key is None or key["owner"] != repo["id"]:
+      raise NotFound()
+    del self.deploy_keys[key["id"]]
+    return 204, None
+
+  def stats(self):
+    return {
+      "requests": sum(self.requests.values()),
+      "endpoints": dict(self.requests),
+      "connections": self.connections,
+      "errors": self.errors,
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  # like Go's net/http, don't delay small writes
+  disable_nagle_algorithm = True
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      BaseHTTPRequestHandler.log_message(self, format, *args)
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    with self.server.gogs.lock:
+      self.server.gogs.connections += 1
+
+  def reply(self, status, response=None, content_type="application/json",
+      headers={}):
+    if response is None:
+      content = b""
+    elif content_type == "application/json":
+      content = json.dumps(response).encode("utf-8")
+    else:
+      content = response.encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(content)))
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(content)
+
+  def handle_request(self, method):
+    server = self.server
+    gogs = server.gogs
+    url = urlparse(self.path)
+    length = int(self.headers.get("Content-Length") or 0)
+    body = json.loads(self.rfile.read(length).decode("utf-8")) if length else None
+
+    if url.path == "/_stats":
+      with gogs.lock:
+        return self.reply(200, gogs.stats())
+    if url.path == "/_reset" and method == "POST":
+      with gogs.lock:
+        gogs.reset()
+      return self.reply(204)
+
+    with server.inflight_lock:
+      server.inflight += 1
+      inflight = server.inflight
+    try:
+      # overloaded or flaky server, or one still starting up: fail like nginx
+      # does when Gogs is down
+      if (server.capacity and inflight > server.capacity) or \
+          time.time() < server.ready_at or \
+          random.random() < server.error_rate:
+        with gogs.lock:
+          gogs.errors += 1
+        time.sleep(server.latency)
+        if server.retry_after:
+          return self.reply(503, "<html><body>503 Service Unavailable</body></html>",
+            "text/html", {"Retry-After": str(server.retry_after)})
+        return self.reply(502, "<html><body>502 Bad Gateway</body></html>",
+          "text/html")
+
+      if server.workers:
+        server.workers.acquire()
+      try:
+        time.sleep(server.latency * random.uniform(1 - server.jitter, 1 + server.jitter))
+      finally:
+        if server.workers:
+          server.workers.release()
+      path = url.path
+      if not path.startswith(server.prefix + "api/v1/"):
+        return self.reply(404)
+      path = path[len(server.prefix + "api/v1/"):]
+      query = parse_qs(url.query)
+      with gogs.lock:
+        endpoint, status, response = gogs.route(method, path, query, body)
+        gogs.requests[endpoint] = gogs.requests.get(endpoint, 0) + 1
+      if endpoint == "POST repos/migrate" and status == 201:
+        # Gogs clones the repository before it responds
+        time.sleep(server.migrate_time)
+        with gogs.lock:
+          status, response = gogs.finish_migration(response, body["clone_addr"])
+      headers = {}
+      if isinstance(response, list) and server.paginate and "limit" in query:
+        response, headers = self.paginate(response, url, query)
+      self.reply(status, response, headers=headers)
+    finally:
+      with server.inflight_lock:
+        server.inflight -= 1
+
+  def paginate(self, items, url, query):
+    """
+    Returns the requested page of a list response and the pagination headers
+    (Link and X-Total-Count, like Gitea).
+    """
+    limit = max(int(query["limit"][0]), 1)
+    page = max(int(query.get("page", ["1"])[0]), 1)
+    last = max((len(items) + limit - 1) // limit, 1)
+    links = []
+    for rel, number in (("next", page + 1), ("last", last)):
+      if page < last and number <= last:
+        params = dict(query, page=[str(number)])
+        links.append('<%s?%s>; rel="%s"' % (url.path,
+          "&".join("%s=%s" % (k, v[0]) for k, v in sorted(params.items())), rel))
+    headers = {"X-Total-Count": str(len(items))}
+    if links:
+      headers["Link"] = ", ".join(links)
+    return items[(page - 1) * limit:page * limit], headers
+
+  def do_GET(self):
+    self.handle_request("GET")
+
+  def do_POST(self):
+    self.handle_request("POST")
+
+  def do_PATCH(self):
+    self.handle_request("PATCH")
+
+  def do_PUT(self):
+    self.handle_request("PUT")
+
+  def do_DELETE(self):
+    self.handle_request("DELETE")
+
+
+class FakeGogsServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address, prefix="/", latency=0.0, jitter=0.0,
+      error_rate=0.0, capacity=0, workers=0, retry_after=0, paginate=True,
+      migrate_time=0.0, startup_time=0.0, admin="admin",
+      search_limit=SEARCH_LIMIT, verbose=False):
+    HTTPServer.__init__(self, address, Handler)
+    self.gogs = FakeGogs(admin, search_limit)
+    self.prefix = "/" + prefix.strip("/") + "/" if prefix.strip("/") else "/"
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.capacity = capacity
+    self.workers = threading.Semaphore(workers) if workers else None
+    self.retry_after = retry_after
+    self.paginate = paginate
+    self.migrate_time = migrate_time
+    self.ready_at = time.time() + startup_time
+    self.verbose = verbose
+    self.inflight = 0
+    self.inflight_lock = threading.Lock()
+
+  def handle_error(self, request, client_address):
+    # clients may close connections without reading the whole response
+    if self.verbose:
+      HTTPServer.handle_error(self, request, client_address)
+
+  @property
+  def url(self):
+    return "http://%s:%d%s" % (self.server_address[0], self.server_address[1],
+      self.prefix)
+
+
+def start_server(**kwargs):
+  """
+  Start a FakeGogsServer on a free port of localhost in a background thread
+  and return it. Keyword arguments are passed to FakeGogsServer.
+  """
+  server = FakeGogsServer(("127.0.0.1", 0), **kwargs)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--port", type=int, default=3000)
+  parser.add_argument("--prefix", default="/gogs",
+    help="path under which the API is served (default: %(default)s)")
+  parser.add_argument("--admin", default="admin",
+    help="name of the admin user, i.e. the login user of the modules")
+  parser.add_argument("--latency", type=float, default=0.0,
+    help="seconds to wait before answering each request")
+  parser.add_argument("--jitter", type=float, default=0.0,
+    help="relative random variation of the latency (0..1)")
+  parser.add_argument("--error-rate", type=float, default=0.0,
+    help="fraction of requests answered with 502 Bad Gateway")
+  parser.add_argument("--capacity", type=int, default=0,
+    help="concurrent requests beyond which the server answers with 502")
+  parser.add_argument("--workers", type=int, default=0,
+    help="number of requests served at the same time; others wait")
+  parser.add_argument("--retry-after", type=int, default=0,
+    help="answer errors with 503 and this Retry-After (seconds) instead of 502")
+  parser.add_argument("--no-pagination", action="store_true",
+    help="ignore page and limit of list endpoints, like older Gogs versions")
+  parser.add_argument("--migrate-time", type=float, default=0.0,
+    help="seconds a migration takes (those from URLs containing 'fail' fail)")
+  parser.add_argument("--startup-time", type=float, default=0.0,
+    help="seconds after starting during which all requests fail with 502")
+  parser.add_argument("--search-limit", type=int, default=SEARCH_LIMIT,
+    help="cap of the number of search results, i.e. [ui] EXPLORE_PAGING_NUM "
+      "(default: %(default)s)")
+  parser.add_argument("--verbose", action="store_true", help="log requests")
+  args = parser.parse_args()
+
+  server = FakeGogsServer(("127.0.0.1", args.port), prefix=args.prefix,
+    latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+    capacity=args.capacity, workers=args.workers, retry_after=args.retry_after,
+    paginate=not args.no_pagination, migrate_time=args.migrate_time,
+    startup_time=args.startup_time, admin=args.admin,
+    search_limit=args.search_limit, verbose=args.verbose)
+  print("Serving fake Gogs API at %s" % server.url)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Benchmark provisioning of workshop seats with the gogs_* modules.
+
+Runs the modules through ansible-playbook (so module startup, or the
+in-process execution by the action plugins, is included in the measurement)
+against a local fake_gogs server, and reports wall time, number of requests
+and connections, and requests per seat for each scenario:
+
+  users-bulk    create all users with one gogs_user task (users list)
+  users-rerun   run users-bulk again, when nothing needs to change
+  users-cached  like users-rerun, with the state cache of the modules
+  users-loop    create all users by looping over gogs_user with with_items
+  repos-bulk    create a sandbox project per user with one gogs_project task
+  repos-cached  run repos-bulk again, with the state cache of the modules
+  users-reset   reset all seats provisioned by users-bulk and repos-bulk (plus
+                a few extra seats to remove) with one gogs_user task, which
+                recreates them with a sandbox project
+
+Example:
+
+  python ansible/bench/provision_bench.py --seats 10,100 --latency 0.02
+"""
+
+import argparse
+import base64
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+  from urllib2 import Request, urlopen
+except ImportError:
+  from urllib.request import Request, urlopen
+
+from fake_gogs import start_server
+
+
+ANSIBLE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ("users-bulk", "users-rerun", "users-cached", "users-loop",
+  "repos-bulk", "repos-cached", "users-reset")
+
+
+def fake_ssh_key(comment):
+  """
+  Returns a random, well-formed ed25519 public key.
+  """
+  key_type = b"ssh-ed25519"
+  blob = struct.pack(">I", len(key_type)) + key_type + \
+    struct.pack(">I", 32) + os.urandom(32)
+  return "ssh-ed25519 %s %s" % (base64.b64encode(blob).decode("ascii"), comment)
+
+
+def seat_users(seats):
+  return [{"name": "seat%04d" % i, "email": "seat%04d@localhost" % i,
+    "key": fake_ssh_key("seat%04d@bench" % i)} for i in range(seats)]
+
+
+def server_stats(server):
+  url = "http://%s:%d/_stats" % server.server_address
+  return json.loads(urlopen(url).read().decode("utf-8"))
+
+
+def reset_server(server):
+  url = "http://%s:%d/_reset" % server.server_address
+  urlopen(Request(url, data=b"", headers={"Content-Length": "0"})).read()
+
+
+class Runner(object):
+  """
+  Runs single-task playbooks against the fake server.
+  """
+
+  def __init__(self, server, args, workdir):
+    self.server = server
+    self.args = args
+    self.workdir = workdir
+
+  def connection_params(self):
+    return {
+      "server_url": self.server.url,
+      "login_user": "admin",
+      "login_password": "secret",
+    }
+
+  def run(self, task, extra_vars):
+    playbook = os.path.join(self.workdir, "bench.yml")
+    vars_file = os.path.join(self.workdir, "vars.json")
+    # JSON is valid YAML
+    with open(playbook, "w") as f:
+      json.dump([{"hosts": "localhost", "connection": "local",
+        "gather_facts": False, "tasks": [task]}], f)
+    with open(vars_file, "w") as f:
+      json.dump(dict(extra_vars, ansible_python_interpreter=sys.executable), f)
+
+    env = dict(os.environ,
+      ANSIBLE_LIBRARY=os.path.join(ANSIBLE_DIR, "library"),
+      ANSIBLE_MODULE_UTILS=os.path.join(ANSIBLE_DIR, "module_utils"),
+      ANSIBLE_CALLBACK_PLUGINS=os.path.join(ANSIBLE_DIR, "callback_plugins"),
+      # (an empty value would make Ansible fall back to other paths)
+      ANSIBLE_ACTION_PLUGINS=self.workdir if self.args.no_action_plugins else
+        os.path.join(ANSIBLE_DIR, "action_plugins"),
+      ANSIBLE_CALLBACK_WHITELIST="gogs_timings",
+      ANSIBLE_CALLBACKS_ENABLED="gogs_timings",
+      ANSIBLE_RETRY_FILES_ENABLED="false",
+      ANSIBLE_FORKS=str(self.args.forks))
+    command = [self.args.ansible_playbook, "-i", "localhost,", "-e",
+      "@" + vars_file, playbook]
+    output = None if self.args.verbose else open(os.devnull, "w")
+
+    before = server_stats(self.server)
+    start = time.time()
+    status = subprocess.call(command, env=env, stdout=output, stderr=output)
+    elapsed = time.time() - start
+    after = server_stats(self.server)
+    return {
+      "ok": status == 0,
+      "wall_time": elapsed,
+      "requests": after["requests"] - before["requests"],
+      "connections": after["connections"] - before["connections"],
+      "errors": after["errors"] - before["errors"],
+    }
+
+  def users_task(self, cache=False):
+    task = {"gogs_user": dict(self.connection_params(),
+      users="{{ bench_users }}", password="secret", sshkey_name="default",
+      max_workers=self.args.max_workers)}
+    if cache:
+      task["gogs_user"]["cache"] = os.path.join(self.workdir, "cache.json")
+    return task
+
+  def repos_task(self, cache=False):
+    task = {"gogs_project": dict(self.connection_params(),
+      repos="{{ bench_repos }}", auto_init=True,
+      max_workers=self.args.max_workers)}
+    if cache:
+      task["gogs_project"]["cache"] = os.path.join(self.workdir, "cache.json")
+    return task
+
+  def scenario(self, name, seats):
+    users = seat_users(seats)
+    repos = [{"owner": user["name"], "name": "sandbox"} for user in users]
+    reset_server(self.server)
+    cache = os.path.join(self.workdir, "cache.json")
+    if os.path.exists(cache):
+      os.remove(cache)
+
+    if name in ("users-rerun", "users-cached"):
+      # provision first, then measure the run which doesn't change anything
+      cached = name == "users-cached"
+      self.run(self.users_task(cached), {"bench_users": users})
+      return self.run(self.users_task(cached), {"bench_users": users})
+    if name == "users-bulk":
+      return self.run(self.users_task(), {"bench_users": users})
+    if name == "users-loop":
+      task = {"gogs_user": dict(self.connection_params(), name="{{ item.name }}",
+        email="{{ item.email }}", password="secret", sshkey_name="default",
+        sshkey_file="{{ item.key }}"), "with_items": "{{ bench_users }}"}
+      return self.run(task, {"bench_users": users})
+    if name == "repos-bulk":
+      self.run(self.users_task(), {"bench_users": users})
+      return self.run(self.repos_task(), {"bench_repos": repos})
+    if name == "users-reset":
+      extra = seat_users(seats + 5)[seats:]
+      self.run(self.users_task(), {"bench_users": users + extra})
+      self.run(self.repos_task(), {"bench_repos": repos})
+      task = self.users_task()
+      task["gogs_user"].update(state="reset", name_prefix="seat",
+        seed_repos=[{"name": "sandbox", "auto_init": True}])
+      return self.run(task, {"bench_users": users})
+    if name == "repos-cached":
+      self.run(self.users_task(), {"bench_users": users})
+      self.run(self.repos_task(True), {"bench_repos": repos})
+      return self.run(self.repos_task(True), {"bench_repos": repos})
+    raise ValueError("unknown scenario %s" % name)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--seats", default="10,100",
+    help="comma-separated numbers of seats (default: %(default)s)")
+  parser.add_argument("--scenarios", default="users-bulk,users-rerun,repos-bulk",
+    help="comma-separated scenarios out of %s (default: %%(default)s)" %
+      ", ".join(SCENARIOS))
+  parser.add_argument("--latency", type=float, default=0.01,
+    help="per-request latency of the fake server (default: %(default)s)")
+  parser.add_argument("--jitter", type=float, default=0.2,
+    help="relative random variation of the latency (default: %(default)s)")
+  parser.add_argument("--error-rate", type=float, default=0.0,
+    help="fraction of requests failing with 502")
+  parser.add_argument("--capacity", type=int, default=0,
+    help="concurrent requests beyond which the fake server answers with 502")
+  parser.add_argument("--workers", type=int, default=0,
+    help="requests the fake server serves at the same time; others wait")
+  parser.add_argument("--retry-after", type=int, default=0,
+    help="let the fake server answer errors with 503 and Retry-After")
+  parser.add_argument("--search-limit", type=int, default=20,
+    help="cap of the fake server's user searches (default: %(default)s)")
+  parser.add_argument("--max-workers", type=int, default=16,
+    help="max_workers parameter of the modules (default: %(default)s)")
+  parser.add_argument("--forks", type=int, default=5,
+    help="Ansible forks (default: %(default)s)")
+  parser.add_argument("--no-action-plugins", action="store_true",
+    help="execute the modules as separate processes, like for remote hosts")
+  parser.add_argument("--ansible-playbook", default="ansible-playbook",
+    help="ansible-playbook executable")
+  parser.add_argument("--json", action="store_true",
+    help="print results as JSON")
+  parser.add_argument("--verbose", action="store_true",
+    help="show Ansible output, including the gogs_timings summary")
+  args = parser.parse_args()
+
+  seats = [int(n) for n in args.seats.split(",")]
+  scenarios = args.scenarios.split(",")
+  for name in scenarios:
+    if name not in SCENARIOS:
+      parser.error("unknown scenario %s" % name)
+
+  server = start_server(latency=args.latency, jitter=args.jitter,
+    error_rate=args.error_rate, capacity=args.capacity, workers=args.workers,
+    retry_after=args.retry_after, search_limit=args.search_limit)
+  workdir = tempfile.mkdtemp(prefix="gogs-bench-")
+  runner = Runner(server, args, workdir)
+  results = []
+  try:
+    if not args.json:
+      print("%-12s %6s %4s %9s %9s %9s %6s %7s" % ("scenario", "seats", "ok",
+        "wall [s]", "requests", "req/seat", "conns", "errors"))
+    for count in seats:
+      for name in scenarios:
+        result = dict(runner.scenario(name, count), scenario=name, seats=count)
+        result["requests_per_seat"] = float(result["requests"]) / count
+        results.append(result)
+        if not args.json:
+          print("%-12s %6d %4s %9.2f %9d %9.1f %6d %7d" % (name, count,
+            "yes" if result["ok"] else "NO", result["wall_time"],
+            result["requests"], result["requests_per_seat"],
+            result["connections"], result["errors"]))
+          sys.stdout.flush()
+  finally:
+    shutil.rmtree(workdir)
+    server.shutdown()
+
+  if args.json:
+    print(json.dumps(results, indent=2))
+  if not all(result["ok"] for result in results):
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
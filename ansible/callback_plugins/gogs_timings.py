@@ -0,0 +1,116 @@
+# Aggregates the request timings returned by the Gogs modules (gogs_user,
+# gogs_project) and prints latency percentiles per endpoint at the end of the
+# playbook run.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import math
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+
+def percentile(values, p):
+  """
+  Returns the p-th percentile (nearest rank) of the sorted list `values`.
+  """
+  if not values:
+    return 0.0
+  rank = int(math.ceil(p / 100.0 * len(values)))
+  return values[min(max(rank, 1), len(values)) - 1]
+
+
+class CallbackModule(CallbackBase):
+  """
+  Collects the `timings` of Gogs module results. For each endpoint (method and
+  path template), shows the number of requests, client errors (4xx, which
+  include the expected 404 of lookups), server and connection errors, response
+  bytes and the p50/p90/p99/max latency. For each
+  task, shows how the wall time splits into API requests, the rest of the
+  module run and the overhead outside of the module (startup, transfer).
+  """
+  CALLBACK_VERSION = 2.0
+  CALLBACK_TYPE = 'aggregate'
+  CALLBACK_NAME = 'gogs_timings'
+  CALLBACK_NEEDS_WHITELIST = True
+  CALLBACK_NEEDS_ENABLED = True
+
+  def __init__(self):
+    super(CallbackModule, self).__init__()
+    self.endpoints = {}
+    self.tasks = []
+    self.task = None
+    self.task_name = None
+    self.task_start = None
+
+  def v2_playbook_on_task_start(self, task, is_conditional):
+    self.task = None
+    self.task_start = time.time()
+    self.task_name = task.get_name()
+
+  def v2_playbook_on_handler_task_start(self, task):
+    self.v2_playbook_on_task_start(task, False)
+
+  def record(self, result):
+    results = result._result.get("results")
+    if not isinstance(results, list):
+      results = [result._result]
+    timings = [res["timings"] for res in results
+      if isinstance(res, dict) and isinstance(res.get("timings"), dict)]
+    if not timings:
+      return
+
+    if self.task is None:
+      self.task = {"name": self.task_name, "wall": 0.0, "module": 0.0,
+        "api": 0.0, "runs": 0}
+      self.tasks.append(self.task)
+    # hosts run in parallel; the task took as long as its slowest host
+    self.task["wall"] = max(self.task["wall"], time.time() - self.task_start)
+    for timing in timings:
+      self.task["module"] += timing.get("elapsed", 0.0)
+      self.task["runs"] += 1
+      for request in timing.get("requests", []):
+        endpoint = self.endpoints.setdefault(
+          (request["method"], request["path"]),
+          {"times": [], "4xx": 0, "errors": 0, "bytes": 0})
+        endpoint["times"].append(request["time"])
+        endpoint["bytes"] += request["bytes"]
+        if 400 <= request["status"] < 500:
+          endpoint["4xx"] += 1
+        elif request["status"] < 0 or request["status"] >= 500:
+          endpoint["errors"] += 1
+        self.task["api"] += request["time"]
+
+  def v2_runner_on_ok(self, result):
+    self.record(result)
+
+  def v2_runner_on_failed(self, result, ignore_errors=False):
+    self.record(result)
+
+  def v2_playbook_on_stats(self, stats):
+    if not self.endpoints:
+      return
+
+    self._display.banner("GOGS API TIMINGS")
+    self._display.display("%-6s %-42s %6s %5s %6s %9s %8s %8s %8s %8s" % (
+      "method", "path", "count", "4xx", "errors", "bytes", "p50 [s]", "p90 [s]", "p99 [s]",
+      "max [s]"))
+    for (method, path), endpoint in sorted(self.endpoints.items(),
+        key=lambda item: -sum(item[1]["times"])):
+      times = sorted(endpoint["times"])
+      self._display.display("%-6s %-42s %6d %5d %6d %9d %8.3f %8.3f %8.3f %8.3f" % (
+        method, path, len(times), endpoint["4xx"], endpoint["errors"],
+        endpoint["bytes"],
+        percentile(times, 50), percentile(times, 90), percentile(times, 99),
+        times[-1]))
+
+    # requests run concurrently in bulk mode, so their sum may exceed the
+    # module run time
+    self._display.display("")
+    self._display.display("%-40s %5s %9s %11s %9s %12s" % ("task", "runs",
+      "wall [s]", "module [s]", "API [s]", "outside [s]"))
+    for task in self.tasks:
+      self._display.display("%-40s %5d %9.2f %11.2f %9.2f %12.2f" % (
+        task["name"][:40], task["runs"], task["wall"], task["module"],
+        task["api"], max(task["wall"] - task["module"], 0.0)))
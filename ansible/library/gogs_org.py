@@ -0,0 +1,456 @@
+#!/usr/bin/python
+
+DOCUMENTATION = '''
+---
+module: gogs_org
+short_description: Manages Gogs organizations, their teams and project collaborators
+description:
+  - When the organization does not exist in Gogs, it will be created.
+  - Team memberships and project collaborators are given as complete lists.
+    The module reads the current members of all given teams and the
+    collaborators of all given projects at once, and then applies only the
+    differences, concurrently. Rearranging teams for a group exercise thus
+    takes a few requests, however many participants are involved.
+  - Requires login_user to be a Gogs site admin.
+  - Gogs API does not allow updating or deleting teams, so the description
+    and permission of existing teams are left as they are, and teams not
+    listed are not removed.
+options:
+  server_url:
+    description: URL of Gogs server, with protocol (http or https)
+    required: true
+  login_user:
+    description: Name of a Gogs site admin.
+    required: true
+  login_password:
+    description: Password of the Gogs user.
+    required: true
+  name:
+    description: Name of the organization.
+    required: true
+  owner:
+    description: User who creates the organization (and becomes a member of
+      its Owners team) if it doesn't exist. Defaults to 'login_user'.
+    required: false
+  full_name:
+    description: Full name of the organization.
+    required: false
+  description:
+    description: A short description of the organization.
+    required: false
+  website:
+    description: Website of the organization.
+    required: false
+  location:
+    description: Location of the organization.
+    required: false
+  teams:
+    description:
+      - List of teams of the organization. Each item is a dict with the key
+        'name' and, optionally, 'description', 'permission' (read, write or
+        admin; for new teams, default read), 'members' (list of user names)
+        and 'repos' (list of project names of the organization the team has
+        access to).
+      - Gogs API cannot list the projects of a team, so the projects are
+        granted to the team on every run, and only counted as a change for
+        new teams. Projects are never taken away from a team.
+    required: false
+  members_exclusive:
+    description: Remove users from the given teams which are not in their
+      'members' list. The login user is never removed from the Owners team.
+      Teams without a 'members' key are left alone.
+    required: false
+    default: true
+  collaborators:
+    description:
+      - Dict mapping projects to their collaborators. Keys are project names
+        of the organization, or owner/name for projects of other users or
+        organizations. Values are lists of user names or dicts with the keys
+        'name' and 'permission' (read, write or admin).
+    required: false
+  collaborator_permission:
+    description: Permission of collaborators given without one.
+    required: false
+    default: write
+    choices: ["read", "write", "admin"]
+  collaborators_exclusive:
+    description: Remove collaborators of the given projects which are not
+      listed.
+    required: false
+    default: true
+  max_workers:
+    description: Maximum number of concurrent threads for reading the teams
+      and collaborators and applying the changes. Failures are collected per
+      change instead of aborting the whole run; the module fails after all
+      changes have been attempted.
+    required: false
+    default: 16
+'''
+
+RETURN = '''
+result:
+  description: Short description of applied changes.
+  returned: changed
+  type: string
+  sample: "Created teams: group-a, group-b. Members and collaborators: added 12, removed 3."
+teams:
+  description: Changes per team, keyed by team name.
+  returned: when 'teams' is given
+  type: dict
+  sample: {"group-a": {"created": true, "added": ["alice", "bob"], "removed": [],
+           "repos": ["exercise-a"]}}
+collaborators:
+  description: Changes per project, keyed by owner/name.
+  returned: when 'collaborators' is given
+  type: dict
+  sample: {"workshop/review": {"added": ["carol"], "updated": [], "removed": ["dave"]}}
+errors:
+  description: Messages of the changes which failed.
+  returned: failed
+  type: list
+  sample: ["Failed to add bob to team group-a: user does not exist"]
+timings:
+  description: Time spent in the module (elapsed, in seconds) and timing of
+    each API request, aggregated per endpoint by the gogs_timings callback plugin.
+  returned: when connected to the server
+  type: dict
+  sample: {"elapsed": 0.38, "requests": [{"method": "GET",
+           "path": "api/v1/admin/teams/%s/members", "status": 200, "bytes": 512,
+           "time": 0.011}]}
+'''
+
+EXAMPLES = '''
+- name: Arrange participants in teams for the group exercise
+  local_action:
+    module: gogs_org
+    server_url: https://gogs.example.com
+    login_user: gogsadmin
+    login_password: secret
+    name: workshop
+    teams:
+      - name: group-a
+        permission: write
+        members: [alice, bob]
+        repos: [exercise-a]
+      - name: group-b
+        permission: write
+        members: [carol, dave]
+        repos: [exercise-b]
+
+- name: Let the reviewers read each other's sandbox
+  local_action:
+    module: gogs_org
+    server_url: https://gogs.example.com
+    login_user: gogsadmin
+    login_password: secret
+    name: workshop
+    collaborator_permission: read
+    collaborators:
+      alice/sandbox: [bob]
+      bob/sandbox: [alice, {name: carol, permission: write}]
+'''
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.urls import url_argument_spec
+from ansible.module_utils.gogs import GogsClient, GogsError, map_concurrently, \
+  reconcile_all
+
+
+ORG_PARAMS = ("full_name", "description", "website", "location")
+
+PERMISSIONS = ("read", "write", "admin")
+
+# Gogs creates this team along with the organization; its permission is
+# "owner", which can't be given to other teams
+OWNERS_TEAM = "Owners"
+
+
+def fetch_all(func, items, max_workers):
+  """
+  Call `func` for each of `items`, using up to `max_workers` concurrent
+  threads, and return the results in order. The first GogsError is raised
+  once all calls are done.
+  """
+  def worker(item):
+    try:
+      return func(item), None
+    except GogsError as e:
+      return None, e
+
+  results = map_concurrently(worker, items, max_workers)
+  for result, error in results:
+    if error is not None:
+      raise error
+  return [result for result, error in results]
+
+
+def reconcile_org(client, params):
+  """
+  Create the organization or update its settings. Returns a tuple
+  (changed, result) like reconcile_project; raises GogsError on failure.
+  """
+  name = params["name"]
+  info, response = client.request("GET", "api/v1/orgs/%s", (name,))
+  if info["status"] == 404:
+    body = {"username": name}
+    for param in ORG_PARAMS:
+      if params[param] is not None:
+        body[param] = params[param]
+    info, response = client.request("POST", "api/v1/admin/users/%s/orgs",
+      (params["owner"] or client.username,), body)
+    if info["status"] != 201:
+      raise GogsError("Failed to create organization %s: %s" % (name, info["msg"]), info)
+    return True, ["Organization created."]
+  if info["status"] != 200:
+    raise GogsError("Failed to query organization %s: %s" % (name, info["msg"]), info)
+
+  update = dict((param, params[param]) for param in ORG_PARAMS
+    if params[param] is not None and params[param] != response.get(param))
+  if not update:
+    return False, []
+  # the API wants all settings, not just the ones to change
+  body = dict((param, response.get(param) or "") for param in ORG_PARAMS)
+  body.update(update)
+  info, response = client.request("PATCH", "api/v1/orgs/%s", (name,), body)
+  if info["status"] != 200:
+    raise GogsError("Failed to update organization %s: %s" % (name, info["msg"]), info)
+  return True, ["Organization updated."]
+
+
+def team_params(entry):
+  """
+  Check an item of the `teams` list and fill in defaults.
+  """
+  if not isinstance(entry, dict) or not entry.get("name"):
+    raise GogsError("Entry in teams list without name: %s" % entry)
+  unsupported = set(entry) - set(["name", "description", "permission", "members", "repos"])
+  if unsupported:
+    raise GogsError("Unsupported parameter '%s' for team %s" %
+      (sorted(unsupported)[0], entry["name"]))
+  team = {"name": entry["name"], "description": entry.get("description") or "",
+    "permission": entry.get("permission") or "read", "members": entry.get("members"),
+    "repos": entry.get("repos") or []}
+  if team["permission"] not in PERMISSIONS:
+    raise GogsError("Invalid permission '%s' for team %s, must be one of %s" %
+      (team["permission"], team["name"], ", ".join(PERMISSIONS)))
+  return team
+
+
+def collaborator_params(collaborators, org, default_permission):
+  """
+  Turn the `collaborators` dict into a dict mapping (owner, name) tuples to
+  dicts of the desired collaborators and their permissions.
+  """
+  desired = {}
+  for path, entries in collaborators.items():
+    owner, sep, name = path.rpartition("/")
+    key = (owner or org, name)
+    desired[key] = {}
+    for entry in entries or []:
+      if not isinstance(entry, dict):
+        entry = {"name": entry}
+      permission = entry.get("permission") or default_permission
+      if not entry.get("name") or permission not in PERMISSIONS:
+        raise GogsError("Invalid collaborator of project %s: %s" % (path, entry))
+      desired[key][entry["name"].lower()] = (entry["name"], permission)
+  return desired
+
+
+def collaborator_permission(collaborator):
+  permissions = collaborator.get("permissions") or {}
+  if permissions.get("admin"):
+    return "admin"
+  if permissions.get("push"):
+    return "write"
+  return "read"
+
+
+def apply_change(client, change):
+  """
+  Apply one membership change, as planned in main(). Returns a tuple
+  (changed, result) for reconcile_all.
+  """
+  method, path, args, body, expected, description = change
+  info, response = client.request(method, path, args, body)
+  if info["status"] not in expected:
+    raise GogsError("Failed to %s: %s" % (description, info["msg"]), info)
+  return True, []
+
+
+def main():
+  argument_spec = url_argument_spec()
+  argument_spec.update({
+    "server_url": dict(required=True),
+    "url_username": dict(required=True, aliases=["login_user"]),
+    "url_password": dict(required=True, aliases=["login_password"]),
+    "timeout": dict(default=30, type='int'),
+    "force_basic_auth": dict(default=True, type='bool'),
+    "name": dict(required=True),
+    "owner": dict(),
+    "full_name": dict(),
+    "description": dict(),
+    "website": dict(),
+    "location": dict(),
+    "teams": dict(type='list'),
+    "members_exclusive": dict(type='bool', default=True),
+    "collaborators": dict(type='dict'),
+    "collaborator_permission": dict(default="write", choices=list(PERMISSIONS)),
+    "collaborators_exclusive": dict(type='bool', default=True),
+    "max_workers": dict(default=16, type='int'),
+  })
+  module = AnsibleModule(
+    argument_spec=argument_spec,
+    supports_check_mode=False
+  )
+
+  if module.params["max_workers"] < 1:
+    module.fail_json(msg="max_workers must be at least 1")
+  org = module.params["name"]
+  max_workers = module.params["max_workers"]
+  try:
+    teams = [team_params(entry) for entry in module.params["teams"] or []]
+    collaborators = collaborator_params(module.params["collaborators"] or {}, org,
+      module.params["collaborator_permission"])
+  except GogsError as e:
+    module.fail_json(msg=e.msg)
+  names = [team["name"].lower() for team in teams]
+  duplicates = sorted(set(name for name in names if names.count(name) > 1))
+  if duplicates:
+    module.fail_json(msg="Duplicate teams in teams list: %s" % ", ".join(duplicates))
+
+  try:
+    client = GogsClient.from_module(module)
+  except GogsError as e:
+    module.fail_json(msg=e.msg)
+
+  try:
+    changed, result = reconcile_org(client, module.params)
+
+    # create missing teams
+    existing = {}
+    if teams:
+      for team in client.iterate("api/v1/orgs/%s/teams", (org,)):
+        existing[team["name"].lower()] = team
+    created = set()
+    missing = [team for team in teams if team["name"].lower() not in existing]
+    def create_team(team):
+      info, response = client.request("POST", "api/v1/admin/orgs/%s/teams", (org,),
+        dict((param, team[param]) for param in ("name", "description", "permission")))
+      if info["status"] != 201:
+        raise GogsError("Failed to create team %s: %s" % (team["name"], info["msg"]), info)
+      return response
+    for team in fetch_all(create_team, missing, max_workers):
+      existing[team["name"].lower()] = team
+      created.add(team["name"].lower())
+
+    # read the current members and collaborators in one go
+    managed = [team for team in teams if team["members"] is not None and
+      team["name"].lower() not in created]
+    def team_members(team):
+      try:
+        return list(client.iterate("api/v1/admin/teams/%s/members",
+          (existing[team["name"].lower()]["id"],)))
+      except GogsError as e:
+        raise GogsError("Failed to get members of team %s: %s" %
+          (team["name"], e.msg), e.info)
+    def repo_collaborators(key):
+      try:
+        return list(client.iterate("api/v1/repos/%s/%s/collaborators", key))
+      except GogsError as e:
+        raise GogsError("Failed to get collaborators of project %s/%s: %s" %
+          (key[0], key[1], e.msg), e.info)
+    repos = sorted(collaborators)
+    current = fetch_all(lambda task: task[0](task[1]),
+      [(team_members, team) for team in managed] +
+      [(repo_collaborators, key) for key in repos], max_workers)
+    members = dict((team["name"].lower(), dict((user["username"].lower(), user["username"])
+      for user in users)) for team, users in zip(managed, current))
+    current_collaborators = dict((key, dict((user["username"].lower(),
+      (user["username"], collaborator_permission(user))) for user in users))
+      for key, users in zip(repos, current[len(managed):]))
+  except GogsError as e:
+    module.fail_json(msg=e.msg, info=e.info, timings=client.timings())
+
+  # plan the changes: each is a tuple of the result dict of the team or
+  # project, the list in it to record the user in, the user, and the request
+  changes = []
+  team_results = {}
+  for team in teams:
+    team_id = existing[team["name"].lower()]["id"]
+    res = team_results[team["name"]] = {"created": team["name"].lower() in created,
+      "added": [], "removed": [], "repos": []}
+    if team["members"] is not None:
+      have = members.get(team["name"].lower(), {})
+      want = dict((user.lower(), user) for user in team["members"])
+      for user in sorted(set(want) - set(have)):
+        changes.append((res, "added", want[user], ("PUT",
+          "api/v1/admin/teams/%s/members/%s", (team_id, want[user]), None, (204,),
+          "add %s to team %s" % (want[user], team["name"]))))
+      if module.params["members_exclusive"]:
+        for user in sorted(set(have) - set(want)):
+          if team["name"].lower() == OWNERS_TEAM.lower() and \
+              user == client.username.lower():
+            continue
+          changes.append((res, "removed", have[user], ("DELETE",
+            "api/v1/admin/teams/%s/members/%s", (team_id, have[user]), None, (204,),
+            "remove %s from team %s" % (have[user], team["name"]))))
+    for repo in team["repos"]:
+      changes.append((res, "repos", repo, ("PUT",
+        "api/v1/admin/teams/%s/repos/%s", (team_id, repo), None, (204,),
+        "grant team %s access to project %s" % (team["name"], repo))))
+
+  repo_results = {}
+  for key in repos:
+    path = "%s/%s" % key
+    res = repo_results[path] = {"added": [], "updated": [], "removed": []}
+    have = current_collaborators[key]
+    for user, (username, permission) in sorted(collaborators[key].items()):
+      if user in have and have[user][1] == permission:
+        continue
+      kind = "updated" if user in have else "added"
+      changes.append((res, kind, username, ("PUT",
+        "api/v1/repos/%s/%s/collaborators/%s", key + (username,),
+        {"permission": permission}, (204,),
+        "add %s as collaborator of project %s" % (username, path))))
+    if module.params["collaborators_exclusive"]:
+      for user in sorted(set(have) - set(collaborators[key])):
+        changes.append((res, "removed", have[user][0], ("DELETE",
+          "api/v1/repos/%s/%s/collaborators/%s", key + (have[user][0],), None, (204,),
+          "remove collaborator %s of project %s" % (have[user][0], path))))
+
+  # apply the delta concurrently; failures are collected per change
+  errors = []
+  counts = {}
+  for (res, kind, user, request), outcome in zip(changes, reconcile_all(
+      lambda change: apply_change(client, change[3]), changes, max_workers)):
+    if outcome.get("failed"):
+      errors.append(outcome["msg"])
+      continue
+    res[kind].append(user)
+    # team projects can't be listed, so we don't know whether they changed
+    if kind != "repos" or res["created"]:
+      counts[kind] = counts.get(kind, 0) + 1
+
+  created_teams = sorted(team for team, res in team_results.items() if res["created"])
+  if created_teams:
+    result.append("Created teams: %s." % ", ".join(created_teams))
+  summary = ["%s %d" % (kind, counts[kind])
+    for kind in ("added", "updated", "removed") if counts.get(kind)]
+  if summary:
+    result.append("Members and collaborators: %s." % ", ".join(summary))
+  changed = changed or bool(created_teams or summary or counts.get("repos"))
+
+  output = dict(changed=changed, timings=client.timings())
+  if teams:
+    output["teams"] = team_results
+  if repos:
+    output["collaborators"] = repo_results
+  if changed:
+    output["result"] = " ".join(result)
+  if errors:
+    module.fail_json(msg="Failed to apply %d of %d changes: %s" %
+      (len(errors), len(changes), errors[0]), errors=errors, **output)
+  module.exit_json(**output)
+
+if __name__ == '__main__':
+  main()
@@ -28,8 +28,56 @@ options:
     default: present
     choices: ["present", "absent"]
   name:
-    description: Name of Gogs project to be created/updated/deleted.
-    required: true
+    description: Name of Gogs project to be created/updated/deleted. Either
+      'name' or 'repos' must be given.
+    required: false
+  repos:
+    description:
+      - List of projects to be created/updated/deleted in a single module
+        invocation. Each item is either a project name or a dict with the key
+        'name' and, optionally, 'owner' or 'group' and any of the other project
+        options of this module. Options not given in an item (except deploy
+        keys) are taken from the module parameters.
+      - The projects are processed concurrently, which is much faster than
+        looping over the module with with_items.
+    required: false
+  max_workers:
+    description: Maximum number of projects which are reconciled concurrently in
+      bulk mode. Failures are collected per project instead of aborting the
+      whole run; the module fails after all projects have been processed. The
+      number of concurrent API requests adapts to how fast the server responds,
+      starting low; requests failing because the server is overloaded (HTTP
+      429, 502, 503, 504) are retried.
+    required: false
+    default: 16
+  cache:
+    description:
+      - Path of a file on the host running the module (usually the Ansible
+        controller, with local_action) in which the parameters last applied to
+        each project are recorded, together with the project's id and update
+        time on the server.
+      - Projects whose parameters didn't change since then are skipped on
+        later runs, which saves most API requests when re-running a playbook.
+        Projects with mirror_sync are never skipped.
+      - Changes made on the server by other means (e.g. through the web
+        interface) are only noticed if they change the id or update time.
+    required: false
+  cache_verify:
+    description: Only skip cached projects if the server still reports the
+      same id and update time (one request per project). If disabled, cached
+      projects cost no API requests at all.
+    required: false
+    default: true
+  cache_invalidate:
+    description: Ignore the entries in the cache file, reconcile all projects
+      and record them anew.
+    required: false
+    default: false
+  owner:
+    description: The user this project belongs to, if it is not the
+      'login_user'. Creating projects for other users requires login_user to
+      be a Gogs site admin.
+    required: false
   description:
     description: A short description of the project
     required: false
@@ -44,6 +92,32 @@ options:
     required: false
     default: false
     type: bool
+  seed_source:
+    description:
+      - Local Git repository or bundle (on the host running the module) whose
+        branches and tags are pushed into the project, or into each project
+        in bulk mode, e.g. to fill them with exercise content.
+      - The content is packed once and pushed into the projects concurrently;
+        pushes to the same host share one SSH connection. Only refs which
+        differ from the project are pushed, so re-runs are cheap. Other refs
+        of the project are left alone.
+      - SSH options (e.g. the key to use) can be given in the GIT_SSH_COMMAND
+        environment variable.
+      - Can't be combined with import_url or mirror, in bulk mode neither in
+        the items of 'repos'.
+    required: false
+  seed_url:
+    description: URL to push seed_source to, in which '{owner}' and '{name}'
+      are replaced with those of the project. By default, the SSH URL
+      reported by Gogs is used.
+    required: false
+  seed_force:
+    description: Also push seed refs which don't fast-forward, replacing
+      changes made in the projects. Otherwise, such refs make the project
+      fail.
+    required: false
+    default: false
+    type: bool
   gitignores:
     description: Desired language .gitignore templates to apply. Use the name
       of the templates. For example, "Go" or "Go,SublimeText".
@@ -66,6 +140,28 @@ options:
   import_password:
     description: Password for accessing import_url.
     required: false
+  import_async:
+    description:
+      - Don't wait for a migration from import_url within a single request.
+        Gogs clones the repository while the request is pending, so imports
+        of large repositories would run into the timeout. Instead, the module
+        polls the project until the clone is done (with exponential backoff).
+      - To go on with the playbook while the imports run, use async/poll on
+        the task.
+    required: false
+    default: false
+    type: bool
+  import_timeout:
+    description: Maximum number of seconds to wait for a migration from
+      import_url, per project. Importing a repository without any branches
+      always runs into this with import_async.
+    required: false
+    default: 600
+  import_max_workers:
+    description: Maximum number of migrations from import_url which run in
+      the server at the same time, in bulk mode.
+    required: false
+    default: 4
   mirror:
     description: Project will be a mirror of import_url.
     required: false
@@ -73,6 +169,21 @@ options:
     description: If the mirror project already exists, perform a sync (with the
       url set in Gogs, which might differ from import_url)
     required: false
+  mirror_sync_wait:
+    description:
+      - After triggering mirror syncs, poll the mirrors (with exponential
+        backoff) until Gogs reports that they were updated, or until
+        mirror_sync_timeout expires. In bulk mode, all syncs are triggered
+        concurrently before waiting for them together.
+      - Gogs only changes the update time of a mirror if the sync fetched new
+        commits, so mirrors which were already up to date are reported as
+        'No new commits in mirror' after the timeout.
+    required: false
+    default: false
+  mirror_sync_timeout:
+    description: Maximum number of seconds to wait for mirror syncs.
+    required: false
+    default: 120
   group:
     description: The group/organization this project belongs to. When not
       provided, project will belong to the user which is configured in
@@ -89,6 +200,19 @@ options:
     aliases:
       sshkey
       deploy_key
+  sshkeys:
+    description: List of additional SSH public deploy keys. Items are either
+      keys, which are titled after the key comment, or dicts with the keys
+      'name' and 'key'. Keys are compared by fingerprint, so differences in
+      comment or whitespace don't cause an update.
+    required: false
+    aliases:
+      deploy_keys
+  sshkeys_exclusive:
+    description: Remove all deploy keys of the project which are not given in
+      sshkey_file/sshkeys.
+    required: false
+    default: false
 '''
 
 RETURN = '''
@@ -97,6 +221,24 @@ result:
   returned: changed
   type: string
   sample: Project created.
+repos:
+  description: Per-project results in bulk mode, keyed by owner/name.
+  returned: when 'repos' is given
+  type: dict
+  sample: {"alice/sandbox": {"changed": true, "result": "Project created. Pushed 2 refs."}}
+cached:
+  description: Number of projects skipped because they were up to date
+    according to the cache.
+  returned: when 'repos' and 'cache' are given
+  type: int
+  sample: 42
+timings:
+  description: Time spent in the module (elapsed, in seconds) and timing of
+    each API request, aggregated per endpoint by the gogs_timings callback plugin.
+  returned: when connected to the server
+  type: dict
+  sample: {"elapsed": 0.41, "requests": [{"method": "GET", "path": "api/v1/users/%s",
+           "status": 404, "bytes": 0, "time": 0.012}]}
 '''
 
 EXAMPLES = '''
@@ -107,108 +249,206 @@ EXAMPLES = '''
     login_user: gogsuser
     login_password: secret
     name: Hello-World
+
+- name: Create a sandbox project for each workshop participant
+  local_action:
+    module: gogs_project
+    server_url: https://gogs.example.com
+    login_user: gogsadmin
+    login_password: secret
+    description: sandbox repository edited during workshop
+    auto_init: true
+    repos:
+      - owner: alice
+        name: sandbox
+      - owner: bob
+        name: sandbox
+
+- name: Fill the exercise project of each participant from a bundle
+  local_action:
+    module: gogs_project
+    server_url: https://gogs.example.com
+    login_user: gogsadmin
+    login_password: secret
+    seed_source: exercises/merge-conflict.bundle
+    repos: "{{ participants | map('regex_replace', '^(.*)$', '\\1/merge-conflict') | list }}"
 '''
 
 from ansible.module_utils.basic import *
-from ansible.module_utils.urls import fetch_url, url_argument_spec
-import json
+from ansible.module_utils.urls import url_argument_spec
+from ansible.module_utils.gogs import GogsClient, GogsError, SeedSource, \
+  StateCache, desired_keys, diff_keys, reconcile_all
+import threading
+import time
+
+
+# backoff limits (in seconds) for polling mirrors after a sync, and
+# migrations which are still running
+MIRROR_POLL_MIN = 1
+MIRROR_POLL_MAX = 16
+
+# seconds to wait for the response to a migration request with import_async;
+# small imports are done by then, larger ones are polled
+MIGRATE_START_TIMEOUT = 5
 
 
-def rest_request(module, method, path, body=None):
+# parameters which can be given per item of the repos list
+PROJECT_PARAMS = ("name", "owner", "group", "state", "description", "public",
+  "auto_init", "gitignores", "license", "readme", "import_url",
+  "import_username", "import_password", "mirror", "mirror_sync", "sshkey_name",
+  "sshkey_file", "sshkeys", "sshkeys_exclusive")
+
+# parameters which can be given per item as well, but only affect how we wait
+# for the result (so they aren't part of the digest recorded in the cache)
+WAIT_PARAMS = ("import_async", "import_timeout")
+
+
+def check_project_params(repo, seeded=False):
   """
-  Generic REST API wrapper.
+  Sanity check the parameters of a project; raises GogsError on failure.
+  `seeded` tells whether the project is to be filled from seed_source.
+  """
+  if seeded and (repo["import_url"] or repo["mirror"]):
+    raise GogsError("seed_source can't be combined with import_url or mirror "
+      "(project %s)" % repo["name"])
+  if repo["mirror"] and not repo["import_url"]:
+    raise GogsError("mirror enabled but no import_url given")
+  if repo["mirror_sync"] and not repo["mirror"]:
+    raise GogsError("mirror_sync requested, but mirror is disabled")
+  if repo["sshkey_name"] and not repo["sshkey_file"] and not repo["sshkeys"]:
+    raise GogsError("sshkey_name given without sshkey_file")
+  if repo["sshkey_file"] and not repo["sshkey_name"]:
+    raise GogsError("sshkey_file given without sshkey_name")
+  if repo["group"] and repo["owner"]:
+    raise GogsError("group and owner are mutually exclusive")
 
-  `module` is the AnsibleModule instance from which `server_url` and other
-  fetch parameters are read.
 
-  `method` is the HTTP method (GET/POST/PATCH/DELETE)
+def project_owner(client, repo):
+  """
+  Returns the name of the user/organization owning the project.
+  """
+  return repo["group"] or repo["owner"] or client.username
 
-  `path` is the resource path, relative to `module.params['server_url']`.
 
-  `body` is the request body for POST/PATCH, as a Python dict/list. It will be
-  converted to JSON before sending to the server.
+def owner_id(client, owner):
   """
-  url = module.params['server_url']
-  if not url.endswith("/"):
-    url += "/"
-  url += path
+  Returns the numeric id of a user or organization, as needed for migrations.
+  """
+  info, response = client.request("GET", "api/v1/users/%s", (owner,))
+  if info["status"] != 200:
+    raise GogsError("Failed to look up owner %s: %s" % (owner, info["msg"]), info)
+  return response["id"]
 
-  data = None
-  headers = {}
-  if body:
-    data = json.dumps(body)
-    headers["Content-Type"] = "application/json"
 
-  resp, info = fetch_url(module, url, method=method, data=data,
-    headers=headers, timeout=module.params['timeout'])
+def migrate_project(client, repo, create_params, imports=None):
+  """
+  Import a project from import_url via /repos/migrate, and return its API
+  representation.
 
-  info["request_body"] = body
-  if body and "password" in body:
-    info["request_body"]["password"] = "********"
+  Gogs clones the repository while the request is pending. With import_async,
+  we only wait MIGRATE_START_TIMEOUT seconds for the response; if it doesn't
+  arrive, the migration goes on in the server, and we poll the project (see
+  wait_for_migration) for up to import_timeout seconds. Otherwise, the request
+  itself may take that long.
 
+  `imports` is an optional semaphore limiting the number of migrations which
+  run at the same time.
+  """
+  owner = project_owner(client, repo)
+  repopath = owner + "/" + repo["name"]
+  timeout = repo["import_timeout"]
+  if imports is not None:
+    imports.acquire()
   try:
-    content = resp.read()
-  except AttributeError:
-    content = info.pop('body', '')
+    deadline = time.time() + timeout
+    info, response = client.request("POST", "api/v1/repos/migrate", (),
+      create_params, timeout=min(MIGRATE_START_TIMEOUT, timeout)
+        if repo["import_async"] else timeout)
+    if info["status"] == 201:
+      return response or {}
+    if not (repo["import_async"] and info.get("timed_out")):
+      raise GogsError("Failed to create project %s: %s" % (repopath, info["msg"]), info)
+    return wait_for_migration(client, owner, repo["name"], deadline)
+  finally:
+    if imports is not None:
+      imports.release()
 
-  if content:
-    return info, json.loads(content)
-  else:
-    return info, None
 
+def wait_for_migration(client, owner, name, deadline):
+  """
+  Poll a project whose migration is running in the server, with exponential
+  backoff, until it has branches (then the clone is done), and return its API
+  representation. Gogs creates the project before cloning, and deletes it
+  again if the clone fails.
 
-def main():
-  argument_spec = url_argument_spec()
-  argument_spec.update({
-    "server_url": dict(required=True),
-    "url_username": dict(required=True, aliases=["login_user"]),
-    "url_password": dict(required=True, aliases=["login_password"]),
-    "timeout": dict(default=30, type='int'),
-    "force_basic_auth": dict(default=True, type='bool'),
-    "state": dict(default="present", choices=["present", "absent"]),
-    "name": dict(required=True),
-    "description": dict(),
-    "public": dict(type='bool', default=False),
-    "auto_init": dict(type='bool'),
-    "gitignores": dict(),
-    "license": dict(),
-    # API docs suggest that the readme parameter can be omitted, but doing so
-    # results in an error when auto_init=true (Gogs 0.10.18), so we set the
-    # default here.
-    "readme": dict(default="Default"),
-    "import_url": dict(),
-    "import_username": dict(),
-    "import_password": dict(),
-    "mirror": dict(type='bool', default=False),
-    "mirror_sync": dict(type='bool', default=False),
-    "group": dict(aliases=["organization"]),
-    "sshkey_name": dict(aliases=["deploy_key_name"]),
-    # sshkey_file is a bit of a misnomer, but we attempt to be compatible with
-    # gitlab_user
-    "sshkey_file": dict(aliases=["sshkey", "deploy_key"]),
-  })
-  module = AnsibleModule(
-    argument_spec=argument_spec,
-    supports_check_mode=False
-  )
+  Raises GogsError if the project disappears or doesn't get any branches
+  until `deadline` (which is also the case for empty repositories).
+  """
+  repopath = owner + "/" + name
+  delay = MIRROR_POLL_MIN
+  seen = False
+  while True:
+    time.sleep(max(0, min(delay, deadline - time.time())))
+    # one branch is enough; large imports have many, which we don't read
+    try:
+      branch = client.find("api/v1/repos/%s/%s/branches", (owner, name))
+      info = {"status": 200}
+    except GogsError as e:
+      branch, info = None, e.info
+    if branch is not None:
+      info, response = client.request("GET", "api/v1/repos/%s/%s", (owner, name))
+      if info["status"] != 200:
+        raise GogsError("Failed to query project %s: %s" % (repopath, info["msg"]), info)
+      return response
+    if info["status"] == 404 and seen:
+      raise GogsError("Failed to import project %s: Gogs removed it again, "
+        "see the Gogs log for the reason" % repopath, info)
+    seen = seen or info["status"] != 404
+    if time.time() >= deadline:
+      raise GogsError("Import of project %s didn't finish within import_timeout; "
+        "it may still complete in the server" % repopath, info)
+    delay = min(delay * 2, MIRROR_POLL_MAX)
 
-  # sanity check arguments
-  if module.params["mirror"] and not module.params["import_url"]:
-    module.fail_json(msg="mirror enabled but no import_url given")
-  if module.params["mirror_sync"] and not module.params["mirror"]:
-    module.fail_json(msg="mirror_sync requested, but mirror is disabled")
-  if module.params["sshkey_name"] and not module.params["sshkey_file"]:
-      module.fail_json(msg="sshkey_name given without sshkey_file")
-  if module.params["sshkey_file"] and not module.params["sshkey_name"]:
-      module.fail_json(msg="sshkey_file given without sshkey_name")
-
-  if module.params["group"]:
-    repopath = module.params["group"] + "/" + module.params["name"]
-  else:
-    repopath = module.params["url_username"] + "/" + module.params["name"]
+
+def reconcile_project(client, repo, synced=None, cache=None, seed=None,
+    imports=None):
+  """
+  Bring a single Gogs project in line with the desired state.
+
+  `repo` is a dict with the keys listed in PROJECT_PARAMS.
+
+  If a mirror sync is triggered and `synced` is a dict, the project is
+  recorded in it for wait_for_mirrors.
+
+  `cache` is an optional StateCache. If the project was last reconciled with
+  the same parameters and (if the cache verifies entries) still has the same
+  id and update time, nothing else is done.
+
+  `seed` is an optional SeedSource, which is pushed into the project (to the
+  URL given by its `url` template, or the project's SSH URL).
+
+  `imports` is an optional semaphore passed on to migrate_project.
+
+  Returns a tuple (changed, result), where `result` is a list of short
+  descriptions of the applied changes. Raises GogsError on failure.
+  """
+  owner = project_owner(client, repo)
+  name = repo["name"]
+  repopath = owner + "/" + name
+
+  digest = marker = None
+  if cache is not None and repo["state"] != "absent" and not repo["mirror_sync"]:
+    params = dict((param, repo[param]) for param in PROJECT_PARAMS)
+    if seed is not None:
+      params["seed"] = [seed.digest, seed.url, seed.force]
+    digest = cache.digest(params)
+    marker = cache.lookup(repopath.lower(), digest)
+    if marker is not None and not cache.verify:
+      cache.hit()
+      return False, []
 
   # get current repo state
-  info, response = rest_request(module, "GET", "api/v1/repos/" + repopath)
+  info, response = client.request("GET", "api/v1/repos/%s/%s", (owner, name))
   if info["status"] == 200:
     repo_exists = True
     old_state = response
@@ -216,18 +456,24 @@ def main():
     repo_exists = False
     old_state = {}
   else:
-    module.fail_json(msg="Error querying Gogs project: %s" % info["msg"], info=info)
+    raise GogsError("Error querying Gogs project: %s" % info["msg"], info)
+
+  if marker is not None and repo_exists and \
+      [old_state.get("id"), old_state.get("updated_at")] == marker:
+    cache.hit()
+    return False, []
 
   # if state=absent, we only need to delete the repo
-  if module.params["state"] == "absent":
+  if repo["state"] == "absent":
+    if cache is not None:
+      cache.forget(repopath.lower())
     if repo_exists:
-      info, response = rest_request(module, "DELETE", "api/v1/repos/" + repopath)
-      if info["status"] == 204:
-        module.exit_json(changed=True, result="Successfully deleted project %s" % repopath)
-      else:
-        module.fail_json(msg="Failed to delete project %s: %s" % (repopath, info["msg"]), info=info)
+      info, response = client.request("DELETE", "api/v1/repos/%s/%s", (owner, name))
+      if info["status"] != 204:
+        raise GogsError("Failed to delete project %s: %s" % (repopath, info["msg"]), info)
+      return True, ["Successfully deleted project %s" % repopath]
     else:
-      module.exit_json(changed=False, result="Project %s already deleted" % repopath)
+      return False, ["Project %s already deleted" % repopath]
 
   # if state=present, we may also need to update the project's parameters
   changed = False
@@ -235,12 +481,14 @@ def main():
 
   if not repo_exists:
     # create repo
-    if module.params["import_url"] is None:
+    if repo["import_url"] is None:
       # create a new repository
-      if module.params["group"]:
-        path = "api/v1/org/%s/repos" % module.params["group"]
+      if repo["group"]:
+        path, path_args = "api/v1/org/%s/repos", (repo["group"],)
+      elif owner != client.username:
+        path, path_args = "api/v1/admin/users/%s/repos", (owner,)
       else:
-        path = "api/v1/user/repos"
+        path, path_args = "api/v1/user/repos", ()
       repo_params = {
         "name": "name",
         "description": "description",
@@ -251,70 +499,350 @@ def main():
       }
     else:
       # migrate/mirror repository from import_url
-      path = "api/v1/repos/migrate"
+      path, path_args = "api/v1/repos/migrate", ()
       repo_params = {
         "clone_addr": "import_url",
         "auth_username": "import_username",
         "auth_password": "import_password",
-        "uid": "url_username",
         "repo_name": "name",
         "mirror": "mirror",
         "description": "description",
       }
-      if module.params["group"]:
-        repo_params["uid"] = "group"
 
     create_params = {}
-    if module.params["public"] is not None:
-      create_params["private"] = not module.params["public"]
-    for gogs_param, mod_param in repo_params.iteritems():
-      if module.params[mod_param] is not None:
-        create_params[gogs_param] = module.params[mod_param]
-
-    info, response = rest_request(module, "POST", path, create_params)
-    if info["status"] != 201:
-      module.fail_json(msg="Failed to create project %s: %s" %
-        (repopath, info["msg"]), info=info)
+    if repo["public"] is not None:
+      create_params["private"] = not repo["public"]
+    for gogs_param, mod_param in repo_params.items():
+      if repo[mod_param] is not None:
+        create_params[gogs_param] = repo[mod_param]
+
+    if repo["import_url"] is None:
+      info, response = client.request("POST", path, path_args, create_params)
+      if info["status"] != 201:
+        raise GogsError("Failed to create project %s: %s" % (repopath, info["msg"]), info)
+      old_state = response or {}
+    else:
+      # the API wants the numeric id of the owner
+      create_params["uid"] = owner_id(client, owner)
+      old_state = migrate_project(client, repo, create_params, imports)
     changed = True
     result.append("Project created.")
 
-  # update ssh key, if necessary
-  if module.params["sshkey_name"] and module.params["sshkey_file" ]:
-    info, response = rest_request(module, "GET" "api/v1/%s/keys" % repopath)
-    if info["status"] != 200:
-      module.fail_json(msg="Failed to get SSH keys for project %s: %s" %
-        (repopath, info["msg"]), info=info)
-    for entry in response:
-      if entry["key"] == module.params["sshkey_file"]:
-        break
+  # update deploy keys, if necessary
+  keys = desired_keys(repo["sshkey_name"], repo["sshkey_file"], repo["sshkeys"])
+  if keys or repo["sshkeys_exclusive"]:
+    if repo_exists:
+      try:
+        existing = list(client.iterate("api/v1/repos/%s/%s/keys", (owner, name)))
+      except GogsError as e:
+        raise GogsError("Failed to get SSH keys for project %s: %s" %
+          (repopath, e.msg), e.info)
     else:
-      # no matching entry found, need update
-      info, response = rest_request(module, "POST", "api/v1/repos/%s/keys" % repopath, {
-        "title": module.params["sshkey_name"],
-        "key": module.params["sshkey_file"]
+      # a project we just created has no deploy keys yet
+      existing = []
+    missing, extra = diff_keys(existing, keys)
+    if not repo["sshkeys_exclusive"]:
+      extra = []
+
+    for title, key in missing:
+      info, response = client.request("POST", "api/v1/repos/%s/%s/keys", (owner, name), {
+        "title": title,
+        "key": key
       })
       if info["status"] != 201:
-	module.fail_json(msg="Failed to set deploy key '%s' for project %s: %s" %
-          (module.params["sshkey_name"], repopath, info["msg"]), info=info)
+        raise GogsError("Failed to set deploy key '%s' for project %s: %s" %
+          (title, repopath, info["msg"]), info)
+    for entry in extra:
+      info, response = client.request("DELETE", "api/v1/repos/%s/%s/keys/%s",
+        (owner, name, entry["id"]))
+      if info["status"] != 204:
+        raise GogsError("Failed to remove deploy key '%s' of project %s: %s" %
+          (entry["title"], repopath, info["msg"]), info)
+
+    if len(missing) + len(extra) == 1:
       changed = True
       result.append("Deploy key updated.")
+    elif missing or extra:
+      changed = True
+      result.append("Deploy keys updated (%d added, %d removed)." % (len(missing), len(extra)))
 
   # execute mirror_sync, if requested
-  if repo_exists and module.params["mirror_sync"]:
-    info, response = rest_request(module, "POST", "api/v1/repos/" + repopath + "/mirror-sync")
+  if repo_exists and repo["mirror_sync"]:
+    info, response = client.request("POST", "api/v1/repos/%s/%s/mirror-sync", (owner, name))
     if info["status"] == 404:
-      module.fail_json(msg="Project %s is not a mirror (according to Gogs)." %
-        repo_path, info=info)
+      raise GogsError("Project %s is not a mirror (according to Gogs)." % repopath, info)
     elif info["status"] != 202:
-      module.fail_json(msg="Failed to sync mirror %s: %s" %
-        (repopath, info["msg"]), info=info)
+      raise GogsError("Failed to sync mirror %s: %s" % (repopath, info["msg"]), info)
     changed = True
     result.append("Project synced.")
+    if synced is not None:
+      synced[repopath] = (owner, name, old_state.get("updated_at"))
+
+  # push seed content, if any
+  if seed is not None:
+    if seed.url:
+      url = seed.url.format(owner=owner, name=name)
+    elif old_state.get("ssh_url"):
+      url = old_state["ssh_url"]
+    else:
+      raise GogsError("Gogs didn't report an SSH URL for project %s, please "
+        "set seed_url" % repopath)
+    updated = seed.push(url)
+    if updated:
+      changed = True
+      result.append("Pushed %d refs." % len(updated))
+      if digest is not None:
+        # the push changed the update time, which the cache records
+        info, response = client.request("GET", "api/v1/repos/%s/%s", (owner, name))
+        if info["status"] == 200:
+          old_state = response
+
+  if digest is not None and old_state.get("id") is not None:
+    cache.store(repopath.lower(), digest,
+      [old_state["id"], old_state.get("updated_at")])
+  return changed, result
+
+
+def wait_for_mirrors(client, synced, timeout):
+  """
+  Poll the mirrors in `synced` (as recorded by reconcile_project) until Gogs
+  reports a new update time for each of them, or until `timeout` seconds have
+  passed. Each mirror is polled with exponential backoff, starting at
+  MIRROR_POLL_MIN and going up to MIRROR_POLL_MAX seconds between requests.
+
+  Gogs only bumps the update time of a mirror if the sync fetched new commits,
+  so a mirror that was already up to date can't be told apart from one whose
+  sync is still running, until the timeout expires.
+
+  Returns a dict mapping project paths to True (mirror updated), False (no
+  update seen until the timeout) or a GogsError.
+  """
+  deadline = time.time() + timeout
+  pending = dict((path, (time.time() + MIRROR_POLL_MIN, MIRROR_POLL_MIN))
+    for path in synced)
+  results = {}
+  while pending:
+    now = time.time()
+    for path, (due, delay) in list(pending.items()):
+      if due > now:
+        continue
+      owner, name, updated_at = synced[path]
+      info, response = client.request("GET", "api/v1/repos/%s/%s", (owner, name))
+      if info["status"] != 200:
+        results[path] = GogsError("Failed to query mirror %s: %s" % (path, info["msg"]), info)
+      elif response.get("updated_at") != updated_at:
+        results[path] = True
+      elif now >= deadline:
+        results[path] = False
+      else:
+        delay = min(delay * 2, MIRROR_POLL_MAX)
+        pending[path] = (min(now + delay, deadline), delay)
+        continue
+      del pending[path]
+    if pending:
+      time.sleep(max(0, min(due for due, delay in pending.values()) - time.time()))
+  return results
+
+
+def apply_mirror_results(results, mirror_results):
+  """
+  Merge the results of wait_for_mirrors into per-project result dicts.
+  """
+  for path, mirror_result in mirror_results.items():
+    res = results[path]
+    if res.get("failed"):
+      # e.g. pushing the seed failed after the sync was triggered
+      continue
+    if isinstance(mirror_result, GogsError):
+      res.update(failed=True, msg=mirror_result.msg, info=mirror_result.info)
+    elif mirror_result:
+      res["result"] += " Mirror updated."
+    else:
+      res["result"] += " No new commits in mirror."
+
+
+def bulk_project_params(module, entry):
+  """
+  Turn an item of the `repos` list into a complete set of project parameters.
+  Settings not given in the item are taken from the module parameters.
+  """
+  if not isinstance(entry, dict):
+    entry = {"name": entry}
+  aliases = {"organization": "group", "deploy_key_name": "sshkey_name",
+    "sshkey": "sshkey_file", "deploy_key": "sshkey_file", "deploy_keys": "sshkeys"}
+  repo = {}
+  for key, value in entry.items():
+    key = aliases.get(key, key)
+    if key not in PROJECT_PARAMS + WAIT_PARAMS:
+      raise GogsError("Unsupported parameter '%s' for project %s" % (key, entry.get("name")))
+    repo[key] = value
+  if not repo.get("name"):
+    raise GogsError("Entry in repos list without name: %s" % entry)
+  # deploy keys are unique per project, so they aren't inherited
+  for param in PROJECT_PARAMS + WAIT_PARAMS:
+    if param not in repo:
+      if param in ("sshkey_name", "sshkey_file", "sshkeys"):
+        repo[param] = None
+      else:
+        repo[param] = module.params[param]
+  if repo["sshkey_file"] and not repo["sshkey_name"]:
+    repo["sshkey_name"] = "default"
+  check_project_params(repo, module.params["seed_source"] is not None)
+  return repo
+
+
+def main():
+  argument_spec = url_argument_spec()
+  argument_spec.update({
+    "server_url": dict(required=True),
+    "url_username": dict(required=True, aliases=["login_user"]),
+    "url_password": dict(required=True, aliases=["login_password"]),
+    "timeout": dict(default=30, type='int'),
+    "force_basic_auth": dict(default=True, type='bool'),
+    "state": dict(default="present", choices=["present", "absent"]),
+    "name": dict(),
+    "repos": dict(type='list'),
+    "max_workers": dict(default=16, type='int'),
+    "cache": dict(type='path'),
+    "cache_verify": dict(type='bool', default=True),
+    "cache_invalidate": dict(type='bool', default=False),
+    "owner": dict(),
+    "description": dict(),
+    "public": dict(type='bool', default=False),
+    "auto_init": dict(type='bool'),
+    "seed_source": dict(type='path'),
+    "seed_url": dict(),
+    "seed_force": dict(type='bool', default=False),
+    "gitignores": dict(),
+    "license": dict(),
+    # API docs suggest that the readme parameter can be omitted, but doing so
+    # results in an error when auto_init=true (Gogs 0.10.18), so we set the
+    # default here.
+    "readme": dict(default="Default"),
+    "import_url": dict(),
+    "import_username": dict(),
+    "import_password": dict(),
+    "import_async": dict(type='bool', default=False),
+    "import_timeout": dict(type='int', default=600),
+    "import_max_workers": dict(type='int', default=4),
+    "mirror": dict(type='bool', default=False),
+    "mirror_sync": dict(type='bool', default=False),
+    "mirror_sync_wait": dict(type='bool', default=False),
+    "mirror_sync_timeout": dict(type='int', default=120),
+    "group": dict(aliases=["organization"]),
+    "sshkey_name": dict(aliases=["deploy_key_name"]),
+    # sshkey_file is a bit of a misnomer, but we attempt to be compatible with
+    # gitlab_user
+    "sshkey_file": dict(aliases=["sshkey", "deploy_key"]),
+    "sshkeys": dict(type='list', aliases=["deploy_keys"]),
+    "sshkeys_exclusive": dict(type='bool', default=False),
+  })
+  module = AnsibleModule(
+    argument_spec=argument_spec,
+    required_one_of=[["name", "repos"]],
+    mutually_exclusive=[["name", "repos"], ["sshkey_file", "repos"],
+      ["sshkeys", "repos"], ["seed_source", "import_url"]],
+    supports_check_mode=False
+  )
+
+  if module.params["max_workers"] < 1:
+    module.fail_json(msg="max_workers must be at least 1")
+  if module.params["import_max_workers"] < 1:
+    module.fail_json(msg="import_max_workers must be at least 1")
+  imports = threading.BoundedSemaphore(module.params["import_max_workers"])
+
+  try:
+    client = GogsClient.from_module(module)
+  except GogsError as e:
+    module.fail_json(msg=e.msg)
+  cache = StateCache.from_module(module, "repos")
+  seed = None
+  if module.params["seed_source"] is not None:
+    try:
+      seed = SeedSource(module.params["seed_source"], module.params["seed_url"],
+        module.params["seed_force"])
+    except GogsError as e:
+      module.fail_json(msg=e.msg)
+
+  if module.params["repos"] is None:
+    synced = {}
+    try:
+      # sanity check arguments
+      check_project_params(module.params, seed is not None)
+      changed, result = reconcile_project(client, module.params, synced, cache,
+        seed, imports)
+    except GogsError as e:
+      module.fail_json(msg=e.msg, info=e.info, timings=client.timings())
+    finally:
+      if seed is not None:
+        seed.close()
+    if cache is not None:
+      cache.save()
+    if synced and module.params["mirror_sync_wait"]:
+      for mirror_result in wait_for_mirrors(client, synced,
+          module.params["mirror_sync_timeout"]).values():
+        if isinstance(mirror_result, GogsError):
+          module.fail_json(msg=mirror_result.msg, info=mirror_result.info,
+            changed=changed, timings=client.timings())
+        elif mirror_result:
+          result.append("Mirror updated.")
+        else:
+          result.append("No new commits in mirror.")
+    if changed:
+      module.exit_json(changed=True, result=" ".join(result), timings=client.timings())
+    else:
+      module.exit_json(changed=False, timings=client.timings())
+
+  # bulk mode: reconcile all projects concurrently
+  repos = []
+  for entry in module.params["repos"]:
+    try:
+      repos.append(bulk_project_params(module, entry))
+    except GogsError as e:
+      if seed is not None:
+        seed.close()
+      module.fail_json(msg=e.msg, timings=client.timings())
+  paths = [project_owner(client, repo) + "/" + repo["name"] for repo in repos]
+  # Gogs owner and project names are case-insensitive
+  lowered = [path.lower() for path in paths]
+  duplicates = sorted(set(path for path in lowered if lowered.count(path) > 1))
+  if duplicates:
+    if seed is not None:
+      seed.close()
+    module.fail_json(msg="Duplicate projects in repos list: %s" %
+      ", ".join(duplicates), timings=client.timings())
+
+  # trigger all mirror syncs first, then wait for them to complete together
+  synced = {}
+  try:
+    results = dict(zip(paths, reconcile_all(
+      lambda repo: reconcile_project(client, repo, synced, cache, seed, imports),
+      repos, module.params["max_workers"])))
+  finally:
+    if seed is not None:
+      seed.close()
+  cached = None
+  if cache is not None:
+    cache.save()
+    cached = cache.hits
+  if synced and module.params["mirror_sync_wait"]:
+    apply_mirror_results(results, wait_for_mirrors(client, synced,
+      module.params["mirror_sync_timeout"]))
 
-  if changed:
-    module.exit_json(changed=True, result=" ".join(result))
+  failed_repos = sorted(path for path, res in results.items() if res.get("failed"))
+  changed_repos = sorted(path for path, res in results.items() if res["changed"])
+  if failed_repos:
+    module.fail_json(msg="Failed to reconcile %d of %d projects: %s" %
+      (len(failed_repos), len(results), ", ".join(failed_repos)),
+      changed=bool(changed_repos), repos=results, cached=cached,
+      timings=client.timings())
+  if changed_repos:
+    module.exit_json(changed=True, repos=results,
+      result="Changed %d of %d projects: %s" % (len(changed_repos), len(results),
+        ", ".join(changed_repos)), cached=cached, timings=client.timings())
   else:
-    module.exit_json(changed=False)
+    module.exit_json(changed=False, repos=results, cached=cached,
+      timings=client.timings())
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+DOCUMENTATION = '''
+---
+module: gogs_ready
+short_description: Waits until the Gogs API answers
+description:
+  - Polls the Gogs API with exponential backoff until Gogs answers with JSON,
+    e.g. right after installing or restarting Gogs, when connections are
+    refused or a reverse proxy in front of it answers with 502.
+  - Run this before the other Gogs modules, so they start as soon as Gogs is
+    up instead of failing.
+options:
+  server_url:
+    description: URL of Gogs server, with protocol (http or https)
+    required: true
+  login_user:
+    description: Name of a Gogs user, whose credentials are checked as well.
+    required: true
+  login_password:
+    description: Password of the Gogs user.
+    required: true
+  wait_timeout:
+    description: Maximum number of seconds to wait for Gogs.
+    required: false
+    default: 300
+'''
+
+RETURN = '''
+attempts:
+  description: Number of requests until Gogs answered.
+  returned: success
+  type: int
+  sample: 4
+timings:
+  description: Time spent in the module (elapsed, in seconds) and timing of
+    each API request, aggregated per endpoint by the gogs_timings callback plugin.
+  returned: always
+  type: dict
+  sample: {"elapsed": 3.52, "requests": [{"method": "GET", "path": "api/v1/user",
+           "status": 502, "bytes": 0, "time": 0.004}]}
+'''
+
+EXAMPLES = '''
+- name: Wait for Gogs to come up
+  local_action:
+    module: gogs_ready
+    server_url: https://gogs.example.com
+    login_user: gogsadmin
+    login_password: secret
+    wait_timeout: 120
+'''
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.urls import url_argument_spec
+from ansible.module_utils.gogs import GogsClient, GogsError
+
+
+def main():
+  argument_spec = url_argument_spec()
+  argument_spec.update({
+    "server_url": dict(required=True),
+    "url_username": dict(required=True, aliases=["login_user"]),
+    "url_password": dict(required=True, aliases=["login_password"]),
+    "timeout": dict(default=30, type='int'),
+    "force_basic_auth": dict(default=True, type='bool'),
+    "wait_timeout": dict(default=300, type='int'),
+  })
+  module = AnsibleModule(
+    argument_spec=argument_spec,
+    supports_check_mode=True
+  )
+
+  try:
+    client = GogsClient.from_module(module)
+  except GogsError as e:
+    module.fail_json(msg=e.msg)
+
+  try:
+    attempts = client.wait_ready(module.params["wait_timeout"])
+  except GogsError as e:
+    module.fail_json(msg=e.msg, info=e.info, timings=client.timings())
+  module.exit_json(changed=False, attempts=attempts, timings=client.timings())
+
+if __name__ == '__main__':
+  main()
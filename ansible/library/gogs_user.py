@@ -29,12 +29,87 @@ options:
       - If 'present', the user will be created or updated. For creating a new
         user, 'password' and 'email' must be given.
       - If 'absent', the user will be deleted.
+      - If 'reset', the user will be deleted together with all projects it
+        owns (if it exists), and created anew, e.g. to prepare a workshop seat
+        for the next session. Projects in 'seed_repos' are created for it.
     required: false
     default: present
-    choices: ["present", "absent"]
+    choices: ["present", "absent", "reset"]
   name:
-    description: Name of Gogs user to be created/updated/deleted.
-    required: true
+    description: Name of Gogs user to be created/updated/deleted. Either
+      'name' or 'users' must be given.
+    required: false
+  users:
+    description:
+      - List of users to be created/updated/deleted in a single module
+        invocation. Each item is a dict with the keys 'name', 'email',
+        'password' and 'key' (the SSH public key); optionally also
+        'keys', 'sshkey_name', 'state' and the profile/permission options of this
+        module. Options not given in an item are taken from the module
+        parameters.
+      - This is much faster than looping over the module with with_items,
+        since the module only has to be shipped and started once.
+    required: false
+  name_prefix:
+    description:
+      - In bulk mode, also delete all users whose name starts with this
+        prefix and which are not in 'users', together with the projects they
+        own. The login user is never deleted.
+      - Together with state=reset, this turns a workshop room around in one
+        task, whether or not the number of seats changed.
+      - The users to delete are found with user searches, which Gogs caps at
+        [ui] EXPLORE_PAGING_NUM results. Results of at least 20 users are
+        split into narrower searches; if the server is configured with a cap
+        below 20, users beyond it may be missed and not deleted.
+    required: false
+  seed_repos:
+    description: Projects to create for the user whenever the user is created
+      (including by state=reset). Items are project names, or dicts with the
+      keys 'name', 'description', 'private', 'auto_init', 'gitignores',
+      'license' and 'readme' of the Gogs API. In bulk mode, items of 'users'
+      may have their own 'seed_repos'.
+    required: false
+  max_workers:
+    description: Maximum number of users which are reconciled concurrently in
+      bulk mode. Failures are collected per user instead of aborting the
+      whole run; the module fails after all users have been processed. The
+      number of concurrent API requests adapts to how fast the server responds,
+      starting low; requests failing because the server is overloaded (HTTP
+      429, 502, 503, 504) are retried.
+    required: false
+    default: 16
+  prefetch:
+    description: In bulk mode, look up the current state of all users with a
+      few user searches up front, instead of querying each user separately.
+      This saves one request per existing user; users which the searches
+      don't find are still looked up one by one. Existing users are still updated on
+      every run if a password is given, since Gogs doesn't tell whether it
+      changed, and their SSH keys are looked up; use 'cache' to skip users
+      which are up to date.
+    required: false
+    default: true
+  cache:
+    description:
+      - Path of a file on the host running the module (usually the Ansible
+        controller, with local_action) in which the parameters last applied to
+        each user are recorded, together with the user's id on the server.
+      - Users whose parameters didn't change since then are skipped on later
+        runs, which saves most API requests when re-running a playbook.
+      - Changes made on the server by other means (e.g. through the web
+        interface) are only noticed if the user was deleted and recreated,
+        i.e. if its id changed.
+    required: false
+  cache_verify:
+    description: Only skip cached users if the server still reports the same
+      id (in bulk mode with prefetch, this costs no additional requests). If
+      disabled, cached users cost no API requests at all.
+    required: false
+    default: true
+  cache_invalidate:
+    description: Ignore the entries in the cache file, reconcile all users and
+      record them anew.
+    required: false
+    default: false
   password:
     description: Password of Gogs user to be created/updated/deleted.
     required: false
@@ -49,6 +124,18 @@ options:
     required: false
     aliases:
       sshkey
+  sshkeys:
+    description: List of additional SSH public keys of the user. Items are
+      either keys, which are titled after the key comment, or dicts with the
+      keys 'name' and 'key'. Keys are compared by fingerprint, so differences
+      in comment or whitespace don't cause an update.
+    required: false
+  sshkeys_exclusive:
+    description: Remove all SSH keys of the user which are not given in
+      sshkey_file/sshkeys. Due to limitations of the Gogs API, this only works
+      for the login_user.
+    required: false
+    default: false
   full_name:
     description: Full name of the user (for profile)
     required: false
@@ -81,6 +168,31 @@ result:
   returned: changed
   type: string
   sample: User created. SSH key updated.
+users:
+  description: Per-user results in bulk mode, keyed by user name.
+  returned: when 'users' is given
+  type: dict
+  sample: {"alice": {"changed": true, "result": "User created."},
+           "bob": {"changed": false, "failed": true, "msg": "Failed to create user bob: HTTP Error 422"}}
+cached:
+  description: Number of users skipped because they were up to date according
+    to the cache.
+  returned: when 'users' and 'cache' are given
+  type: int
+  sample: 42
+summary:
+  description: Number of users and projects deleted and created in bulk mode.
+  returned: when 'users' is given
+  type: dict
+  sample: {"users_deleted": 60, "projects_deleted": 64, "users_created": 60,
+           "projects_created": 60}
+timings:
+  description: Time spent in the module (elapsed, in seconds) and timing of
+    each API request, aggregated per endpoint by the gogs_timings callback plugin.
+  returned: when connected to the server
+  type: dict
+  sample: {"elapsed": 0.41, "requests": [{"method": "GET", "path": "api/v1/users/%s",
+           "status": 404, "bytes": 0, "time": 0.012}]}
 '''
 
 EXAMPLES = '''
@@ -114,182 +226,578 @@ EXAMPLES = '''
     email: john@example.com
     sshkey_name: default
     sshkey_file: "{{ lookup('file', '/home/john/.ssh/id_ed25519.pub') }}"
+
+- name: Create a number of Gogs users at once
+  local_action:
+    module: gogs_user
+    server_url: https://gogs.example.com
+    login_user: gogsadmin
+    login_password: secret
+    users:
+      - name: alice
+        email: alice@example.com
+        password: alicespassword
+        key: "{{ lookup('file', 'id_ed25519_alice.pub') }}"
+      - name: bob
+        email: bob@example.com
+        password: bobspassword
+
+- name: Reset all workshop seats, removing seats which are no longer needed
+  local_action:
+    module: gogs_user
+    server_url: https://gogs.example.com
+    login_user: gogsadmin
+    login_password: secret
+    state: reset
+    name_prefix: seat
+    users: "{{ seats }}"
+    password: seatpassword
+    seed_repos:
+      - name: sandbox
+        auto_init: true
 '''
 
 from ansible.module_utils.basic import *
-from ansible.module_utils.urls import fetch_url, url_argument_spec
-import json
+from ansible.module_utils.urls import url_argument_spec
+from ansible.module_utils.gogs import GogsClient, GogsError, StateCache, Tally, \
+  desired_keys, diff_keys, reconcile_all
+
+
+# parameters we can set via /admin/users/:username
+USER_PARAMS = ("email", "password", "full_name", "website", "location",
+  "admin", "allow_git_hook", "allow_import_local")
+
+
+# page size we ask /users/search for
+SEARCH_LIMIT = 50
+
+# Gogs caps the page size of searches at [ui] EXPLORE_PAGING_NUM, which is 20
+# by default; a result of at least this size may have been truncated
+SEARCH_CAP_MIN = 20
+
+# characters allowed in Gogs user names (which are searched case-insensitively)
+NAME_CHARS = "-.0123456789_abcdefghijklmnopqrstuvwxyz"
+
+# parameters of seed_repos items, passed on to /admin/users/:username/repos
+SEED_REPO_PARAMS = ("name", "description", "private", "auto_init", "gitignores",
+  "license", "readme")
 
 
-def rest_request(module, method, path, body=None):
+def search_users(client, keyword):
   """
-  Generic REST API wrapper.
+  Returns a tuple (users, complete), where `users` maps the lowercase names of
+  all users matching `keyword` (as a substring of name or full name) to their
+  API representation. `complete` is False if the server may have truncated
+  the result: we can't tell the cap the server applies to the page size, so
+  only results smaller than SEARCH_CAP_MIN count as complete. A server
+  configured with a lower cap makes truncated results look complete, so
+  callers mustn't conclude that users which weren't found don't exist.
+  """
+  users = {}
+  page = 1
+  while True:
+    info, response = client.request("GET",
+      "api/v1/users/search?q=%s&limit=%s&page=%s", (keyword, SEARCH_LIMIT, page))
+    if info["status"] != 200 or not isinstance(response, dict):
+      raise GogsError("Failed to search for users: %s" % info["msg"], info)
+    data = response.get("data") or []
+    new = [entry for entry in data if entry["username"].lower() not in users]
+    for entry in new:
+      users[entry["username"].lower()] = entry
+    if len(data) < SEARCH_CAP_MIN:
+      return users, True
+    if not new or len(data) < SEARCH_LIMIT:
+      # the server capped the page size, or ignores the page parameter (Gogs
+      # does both), so we can't get more
+      return users, False
+    page += 1
+
+
+def prefetch_users(client, names):
+  """
+  Fetch the current state of the given users with as few requests as possible.
 
-  `module` is the AnsibleModule instance from which `server_url` and other
-  fetch parameters are read.
+  Gogs has no endpoint to list all users, so we search for the longest common
+  prefix of each group of names with the same initial, splitting a group
+  further whenever the server truncates the search result.
 
-  `method` is the HTTP method (GET/POST/PATCH/DELETE)
+  Returns a dict mapping the lowercase names of the users found to their API
+  representation. Users which weren't found are left out rather than taken
+  as non-existent: the server may cap searches below SEARCH_CAP_MIN, so even
+  a small result may be truncated. reconcile_user looks them up one by one.
+  """
+  known = {}
+
+  def fetch(prefix, group):
+    # extend prefix to the longest common prefix of the group
+    while all(len(name) > len(prefix) and name[len(prefix)] == group[0][len(prefix)]
+        for name in group):
+      prefix += group[0][len(prefix)]
+    if prefix:
+      users, complete = search_users(client, prefix)
+    else:
+      users, complete = {}, False
+    for name in group:
+      if name in users:
+        known[name] = users[name]
+    if complete:
+      return
+    # result was truncated; search for the others more specifically
+    rest = [name for name in group if name not in known and len(name) > len(prefix)]
+    for char in sorted(set(name[len(prefix)] for name in rest)):
+      fetch(prefix + char, [name for name in rest if name[len(prefix)] == char])
+
+  names = sorted(set(name.lower() for name in names))
+  for initial in sorted(set(name[0] for name in names)):
+    fetch(initial, [name for name in names if name[0] == initial])
+  return known
+
+
+def users_with_prefix(client, prefix):
+  """
+  Returns a dict mapping the lowercase names of all users whose name starts
+  with `prefix` to their API representation. Like prefetch_users, this splits
+  the search by the next character whenever the server may have truncated the
+  result (see search_users). On a server capping searches below
+  SEARCH_CAP_MIN, users may be missing, so a name with the prefix which isn't
+  in the dict may still exist.
+  """
+  found = {}
+
+  def fetch(prefix):
+    users, complete = search_users(client, prefix)
+    # the search also matches in the middle of names and in full names
+    for name, entry in users.items():
+      if name.startswith(prefix):
+        found[name] = entry
+    if complete:
+      return
+    if prefix not in found:
+      info, response = client.request("GET", "api/v1/users/%s", (prefix,))
+      if info["status"] == 200:
+        found[prefix] = response
+      elif info["status"] != 404:
+        raise GogsError("Error querying Gogs server: %s" % info["msg"], info)
+    for char in NAME_CHARS:
+      fetch(prefix + char)
+
+  fetch(prefix.lower())
+  return found
+
+
+def delete_user(client, username, tally=None):
+  """
+  Delete a user together with the projects it owns (Gogs refuses to delete
+  users who still own projects). SSH keys are deleted along with the user.
+
+  Returns the number of deleted projects. Raises GogsError on failure.
+  """
+  try:
+    repos = [repo for repo in client.iterate("api/v1/users/%s/repos", (username,))
+      if repo["owner"]["username"].lower() == username.lower()]
+  except GogsError as e:
+    raise GogsError("Failed to list projects of user %s: %s" % (username, e.msg), e.info)
+  for repo in repos:
+    info, response = client.request("DELETE", "api/v1/repos/%s/%s",
+      (repo["owner"]["username"], repo["name"]))
+    if info["status"] not in (204, 404):
+      raise GogsError("Failed to delete project %s: %s" %
+        (repo["full_name"], info["msg"]), info)
+    if tally is not None:
+      tally.add("projects_deleted")
+  info, response = client.request("DELETE", "api/v1/admin/users/%s", (username,))
+  if info["status"] != 204:
+    raise GogsError("Failed to delete user %s: %s" % (username, info["msg"]), info)
+  if tally is not None:
+    tally.add("users_deleted")
+  return len(repos)
+
+
+def purge_user(client, username, tally=None):
+  """
+  Delete a user which matches name_prefix, but isn't in the users list.
+  Returns a tuple (changed, result) like reconcile_user.
+  """
+  projects = delete_user(client, username, tally)
+  return True, ["User deleted with %d projects." % projects]
 
-  `path` is the resource path, relative to `module.params['server_url']`.
 
-  `body` is the request body for POST/PATCH, as a Python dict/list. It will be
-  converted to JSON before sending to the server.
+def seed_repos(client, username, repos, tally=None):
   """
-  url = module.params['server_url']
-  if not url.endswith("/"):
-    url += "/"
-  url += path
+  Create the projects given in `repos` (see the seed_repos option) for a user
+  we just created. Returns the number of created projects.
+  """
+  for repo in repos:
+    if not isinstance(repo, dict):
+      repo = {"name": repo}
+    if not repo.get("name") or any(key not in SEED_REPO_PARAMS for key in repo):
+      raise GogsError("Invalid item in seed_repos: %s" % repo)
+    info, response = client.request("POST", "api/v1/admin/users/%s/repos",
+      (username,), repo)
+    if info["status"] != 201:
+      raise GogsError("Failed to create project %s/%s: %s" %
+        (username, repo["name"], info["msg"]), info)
+    if tally is not None:
+      tally.add("projects_created")
+  return len(repos)
 
-  data = None
-  headers = {}
-  if body:
-    data = json.dumps(body)
-    headers["Content-Type"] = "application/json"
 
-  resp, info = fetch_url(module, url, method=method, data=data,
-    headers=headers, timeout=module.params['timeout'])
+def reconcile_user(client, user, known=None, cache=None, tally=None):
+  """
+  Bring a single Gogs user in line with the desired state.
 
-  info["request_body"] = body
-  if body and "password" in body:
-    info["request_body"]["password"] = "********"
+  `user` is a dict with the same keys as the module parameters (username,
+  state, email, password, sshkey_name, sshkey_file, ...).
 
-  try:
-    content = resp.read()
-  except AttributeError:
-    content = info.pop('body', '')
+  `known` is an optional dict as returned by prefetch_users. If the user is
+  contained in it, we don't need to query the server for the user's state.
 
-  if content:
-    return info, json.loads(content)
-  else:
-    return info, None
+  `cache` is an optional StateCache. If the user was last reconciled with the
+  same parameters and (if the cache verifies entries) still has the same id,
+  nothing else is done (unless state=reset).
 
+  `tally` is an optional Tally, which counts deleted and created users and
+  projects.
 
-def main():
-  argument_spec = url_argument_spec()
-  argument_spec.update({
-    "server_url": dict(required=True),
-    "url_username": dict(required=True, aliases=["login_user"]),
-    "url_password": dict(required=True, aliases=["login_password"]),
-    "timeout": dict(required=False, default=30, type='int'),
-    "force_basic_auth": dict(required=False, default=True),
-    "state": dict(default="present", choices=["present", "absent"]),
-    "username": dict(required=True, aliases=["name"]),
-    "password": dict(required=False),
-    "email": dict(required=False),
-    "sshkey_name": dict(required=False),
-    # sshkey_file is a bit of a misnomer, but we attempt to be compatible with
-    # gitlab_user
-    "sshkey_file": dict(required=False, aliases=["sshkey"]),
-    "full_name": dict(required=False),
-    "website": dict(required=False),
-    "location": dict(required=False),
-    "admin": dict(required=False, type='bool'),
-    "allow_git_hook": dict(required=False, type='bool'),
-    "allow_import_local": dict(required=False, type='bool'),
-  })
-  module = AnsibleModule(
-    argument_spec=argument_spec,
-    supports_check_mode=False
-  )
+  Returns a tuple (changed, result), where `result` is a list of short
+  descriptions of the applied changes. Raises GogsError on failure.
+  """
+  username = user["username"]
 
-  if module.params["sshkey_name"] and not module.params["sshkey_file"]:
-      module.fail_json(msg="sshkey_name given without sshkey_file")
-  if module.params["sshkey_file"] and not module.params["sshkey_name"]:
-      module.fail_json(msg="sshkey_file given without sshkey_name")
+  if user["state"] == "reset" and username.lower() == client.username.lower():
+    raise GogsError("Cannot reset the login user %s" % username)
 
-  username = module.params["username"]
+  digest = marker = None
+  if cache is not None and user["state"] != "absent":
+    digest = cache.digest(dict((param, user[param]) for param in ("username",
+      "sshkey_name", "sshkey_file", "sshkeys", "sshkeys_exclusive") + USER_PARAMS))
+    if user["state"] == "present":
+      marker = cache.lookup(username.lower(), digest)
+    if marker is not None and not cache.verify:
+      cache.hit()
+      return False, []
 
   # get current user state
-  info, response = rest_request(module, "GET", "api/v1/users/" + username)
-  if info["status"] == 200:
-    user_exists = True
-    old_state = response
-  elif info["status"] == 404:
-    user_exists = False
-    old_state = {}
+  if known is not None and username.lower() in known:
+    old_state = known[username.lower()]
+    user_exists = old_state is not None
+    old_state = old_state or {}
   else:
-    module.fail_json(msg="Error querying Gogs server: %s" % info["msg"], info=info)
+    info, response = client.request("GET", "api/v1/users/%s", (username,))
+    if info["status"] == 200:
+      user_exists = True
+      old_state = response
+    elif info["status"] == 404:
+      user_exists = False
+      old_state = {}
+    else:
+      raise GogsError("Error querying Gogs server: %s" % info["msg"], info)
+
+  if marker is not None and user_exists and old_state.get("id") == marker:
+    cache.hit()
+    return False, []
 
   # if state=absent, we only need to delete the user
-  if module.params["state"] == "absent":
+  if user["state"] == "absent":
+    if cache is not None:
+      cache.forget(username.lower())
     if user_exists:
-      info, response = rest_request(module, "DELETE", "api/v1/admin/users/" + username)
-      if info["status"] == 204:
-        module.exit_json(changed=True, result="Successfully deleted user %s" % username)
-      else:
-        module.fail_json(msg="Failed to delete user %s: %s" % (username, info["msg"]), info=info)
+      info, response = client.request("DELETE", "api/v1/admin/users/%s", (username,))
+      if info["status"] != 204:
+        raise GogsError("Failed to delete user %s: %s" % (username, info["msg"]), info)
+      return True, ["Successfully deleted user %s" % username]
     else:
-      module.exit_json(changed=False, result="User %s already deleted" % username)
+      return False, ["User %s already deleted" % username]
 
   # if state=present, we may also need to update the user's parameters
   changed = False
   result = []
 
+  if user["state"] == "reset" and user_exists:
+    if cache is not None:
+      cache.forget(username.lower())
+    projects = delete_user(client, username, tally)
+    changed = True
+    result.append("User deleted with %d projects." % projects)
+    user_exists = False
+    old_state = {}
+
   if not user_exists:
-    if not module.params["password"] or not module.params["email"]:
-      module._fail_json(msg="If state=present (default), password and email must be given.")
+    if not user["password"] or not user["email"]:
+      raise GogsError("If state=present (default), password and email must be given.")
 
     # create user
-    info, response = rest_request(module, "POST", "api/v1/admin/users", {
+    info, response = client.request("POST", "api/v1/admin/users", body={
       "username": username,
-      "email": module.params["email"],
-      "password": module.params["password"]
+      "email": user["email"],
+      "password": user["password"]
     })
     if info["status"] != 201:
-      module.fail_json(msg="Failed to create user %s: %s" % (username, info["msg"]), info=info)
+      raise GogsError("Failed to create user %s: %s" % (username, info["msg"]), info)
     changed = True
     result.append("User created.")
+    old_state = {"id": response.get("id")}
+    if tally is not None:
+      tally.add("users_created")
 
   # update the parameters we can set via /admin/users/:username
-  user_params = ("email", "password", "full_name", "website", "location",
-    "admin", "allow_git_hook", "allow_import_local")
-  if user_exists or any(module.params[param] for param in user_params):
-    new_state = {}
-
+  new_state = {}
+  if user_exists or any(user[param] for param in USER_PARAMS):
     # FIXME: Gogs API appears to be missing a way to query most of these settings, so
     # we can't tell whether they changed.
-    for param in user_params:
-      if module.params[param] is None:
+    for param in USER_PARAMS:
+      if user[param] is None:
         continue
       if param in old_state:
-        if old_state[param] != module.params[param]:
-          new_state[param] = module.params[param]
+        if old_state[param] != user[param]:
+          new_state[param] = user[param]
           changed = True
       else:
-        new_state[param] = module.params[param]
+        new_state[param] = user[param]
 
+  # skip the update if all parameters we were given are known to be unchanged
+  if new_state:
     # Gogs API requires the email address for updates, even if it didn't change
     if not "email" in new_state:
-      new_state["email"] = old_state["email"]
+      new_state["email"] = old_state.get("email", user["email"])
 
-    info, response = rest_request(module, "PATCH", "api/v1/admin/users/" + username, new_state)
+    info, response = client.request("PATCH", "api/v1/admin/users/%s", (username,), new_state)
     if info["status"] != 200:
-      module.fail_json(msg="Failed to update user %s: %s" % (username, info["msg"]), info=info)
+      raise GogsError("Failed to update user %s: %s" % (username, info["msg"]), info)
 
-  # update ssh key, if necessary
-  if module.params["sshkey_name"] and module.params["sshkey_file" ]:
-    info, response = rest_request(module, "GET", "api/v1/users/%s/keys" % username)
-    if info["status"] != 200:
-      module.fail_json(msg="Failed to get SSH keys for user %s: %s" % (username, info["msg"]), info=info)
-    for entry in response:
-      if entry["key"] == module.params["sshkey_file"]:
-        break
+  # update ssh keys, if necessary
+  keys = desired_keys(user["sshkey_name"], user["sshkey_file"], user["sshkeys"])
+  if keys or user["sshkeys_exclusive"]:
+    if user_exists:
+      try:
+        existing = list(client.iterate("api/v1/users/%s/keys", (username,)))
+      except GogsError as e:
+        raise GogsError("Failed to get SSH keys for user %s: %s" % (username, e.msg), e.info)
     else:
-      # no matching entry found, need update
-      info, response = rest_request(module, "POST", "api/v1/admin/users/%s/keys" % username, {
-        "title": module.params["sshkey_name"],
-        "key": module.params["sshkey_file"]
+      # a user we just created has no keys yet
+      existing = []
+    missing, extra = diff_keys(existing, keys)
+    if not user["sshkeys_exclusive"]:
+      extra = []
+    # the admin API only allows adding keys; users can delete their own keys
+    if extra and username != client.username:
+      raise GogsError("Cannot remove SSH keys of user %s: Gogs API only allows "
+        "removing keys of the login user" % username)
+
+    for title, key in missing:
+      info, response = client.request("POST", "api/v1/admin/users/%s/keys", (username,), {
+        "title": title,
+        "key": key
       })
       if info["status"] != 201:
-	module.fail_json(msg="Failed to set SSH key '%s' for user %s: %s" %
-          (module.params["sshkey_name"], username, info["msg"]), info=info)
+        raise GogsError("Failed to set SSH key '%s' for user %s: %s" %
+          (title, username, info["msg"]), info)
+    for entry in extra:
+      info, response = client.request("DELETE", "api/v1/user/keys/%s", (entry["id"],))
+      if info["status"] != 204:
+        raise GogsError("Failed to remove SSH key '%s' of user %s: %s" %
+          (entry["title"], username, info["msg"]), info)
+
+    if len(missing) + len(extra) == 1:
       changed = True
       result.append("SSH key updated.")
+    elif missing or extra:
+      changed = True
+      result.append("SSH keys updated (%d added, %d removed)." % (len(missing), len(extra)))
+
+  if not user_exists and user["seed_repos"]:
+    projects = seed_repos(client, username, user["seed_repos"], tally)
+    result.append("%d projects created." % projects)
+
+  if digest is not None and old_state.get("id") is not None:
+    cache.store(username.lower(), digest, old_state["id"])
+  return changed, result
+
+
+def bulk_user_params(module, entry):
+  """
+  Turn an item of the `users` list into a complete set of user parameters.
+  Settings not given in the item are taken from the module parameters, so
+  common values (e.g. state or admin) only need to be specified once.
+  """
+  if not isinstance(entry, dict):
+    entry = {"username": entry}
+  aliases = {"name": "username", "key": "sshkey_file", "sshkey": "sshkey_file",
+    "keys": "sshkeys"}
+  user = {}
+  for key, value in entry.items():
+    key = aliases.get(key, key)
+    if key not in ("username", "state", "sshkey_name", "sshkey_file", "sshkeys",
+        "sshkeys_exclusive", "seed_repos") + USER_PARAMS:
+      raise GogsError("Unsupported parameter '%s' for user %s" %
+        (key, entry.get("name", entry.get("username"))))
+    user[key] = value
+  if not user.get("username"):
+    raise GogsError("Entry in users list without name: %s" % entry)
+  for param in ("state", "sshkey_name", "sshkeys_exclusive", "seed_repos") + USER_PARAMS:
+    if param not in user:
+      user[param] = module.params[param]
+  for param in ("sshkey_file", "sshkeys"):
+    if param not in user:
+      user[param] = None
+  if user["sshkey_file"] and not user["sshkey_name"]:
+    user["sshkey_name"] = "default"
+  return user
+
+
+def reconcile_users(client, users, max_workers, known=None, cache=None,
+    tally=None, purge=()):
+  """
+  Reconcile a list of users (as returned by bulk_user_params), and delete the
+  users named in `purge`, using up to `max_workers` concurrent threads.
+  `known`, `cache` and `tally` are passed on to reconcile_user.
+
+  Returns a dict mapping user names to result dicts (see reconcile_all).
+  """
+  def reconcile(item):
+    if isinstance(item, dict):
+      return reconcile_user(client, item, known, cache, tally)
+    return purge_user(client, item, tally)
+
+  items = list(users) + list(purge)
+  results = reconcile_all(reconcile, items, max_workers)
+  return dict((item["username"] if isinstance(item, dict) else item, res)
+    for item, res in zip(items, results))
+
 
-  if changed:
-    module.exit_json(changed=True, result=" ".join(result))
+def main():
+  argument_spec = url_argument_spec()
+  argument_spec.update({
+    "server_url": dict(required=True),
+    "url_username": dict(required=True, aliases=["login_user"]),
+    "url_password": dict(required=True, aliases=["login_password"]),
+    "timeout": dict(required=False, default=30, type='int'),
+    "force_basic_auth": dict(required=False, default=True),
+    "state": dict(default="present", choices=["present", "absent", "reset"]),
+    "username": dict(required=False, aliases=["name"]),
+    "users": dict(required=False, type='list'),
+    "name_prefix": dict(required=False),
+    "seed_repos": dict(required=False, type='list'),
+    "max_workers": dict(required=False, default=16, type='int'),
+    "prefetch": dict(required=False, default=True, type='bool'),
+    "cache": dict(required=False, type='path'),
+    "cache_verify": dict(required=False, default=True, type='bool'),
+    "cache_invalidate": dict(required=False, default=False, type='bool'),
+    "password": dict(required=False),
+    "email": dict(required=False),
+    "sshkey_name": dict(required=False),
+    # sshkey_file is a bit of a misnomer, but we attempt to be compatible with
+    # gitlab_user
+    "sshkey_file": dict(required=False, aliases=["sshkey"]),
+    "sshkeys": dict(required=False, type='list'),
+    "sshkeys_exclusive": dict(required=False, default=False, type='bool'),
+    "full_name": dict(required=False),
+    "website": dict(required=False),
+    "location": dict(required=False),
+    "admin": dict(required=False, type='bool'),
+    "allow_git_hook": dict(required=False, type='bool'),
+    "allow_import_local": dict(required=False, type='bool'),
+  })
+  module = AnsibleModule(
+    argument_spec=argument_spec,
+    required_one_of=[["username", "users"]],
+    mutually_exclusive=[["username", "users"], ["sshkey_file", "users"],
+      ["sshkeys", "users"], ["username", "name_prefix"]],
+    supports_check_mode=False
+  )
+
+  if module.params["sshkey_name"] and not module.params["sshkey_file"] \
+      and not module.params["sshkeys"] and not module.params["users"]:
+      module.fail_json(msg="sshkey_name given without sshkey_file")
+  if module.params["sshkey_file"] and not module.params["sshkey_name"]:
+      module.fail_json(msg="sshkey_file given without sshkey_name")
+
+  if module.params["max_workers"] < 1:
+      module.fail_json(msg="max_workers must be at least 1")
+  if module.params["name_prefix"] is not None and not module.params["name_prefix"]:
+      module.fail_json(msg="name_prefix must not be empty")
+
+  try:
+    client = GogsClient.from_module(module)
+  except GogsError as e:
+    module.fail_json(msg=e.msg)
+  cache = StateCache.from_module(module, "users")
+
+  if module.params["users"] is None:
+    try:
+      changed, result = reconcile_user(client, module.params, cache=cache)
+    except GogsError as e:
+      module.fail_json(msg=e.msg, info=e.info, timings=client.timings())
+    if cache is not None:
+      cache.save()
+    if changed:
+      module.exit_json(changed=True, result=" ".join(result), timings=client.timings())
+    else:
+      module.exit_json(changed=False, timings=client.timings())
+
+  # bulk mode: reconcile all users in this process
+  users = []
+  for entry in module.params["users"]:
+    try:
+      users.append(bulk_user_params(module, entry))
+    except GogsError as e:
+      module.fail_json(msg=e.msg, timings=client.timings())
+  names = [user["username"] for user in users]
+  # Gogs user names are case-insensitive
+  lowered = [name.lower() for name in names]
+  duplicates = sorted(set(name for name in lowered if lowered.count(name) > 1))
+  if duplicates:
+    module.fail_json(msg="Duplicate users in users list: %s" %
+      ", ".join(duplicates), timings=client.timings())
+
+  known = None
+  purge = []
+  try:
+    prefix = module.params["name_prefix"]
+    if prefix is not None:
+      # this finds the current state of the listed users with the prefix, too;
+      # those it doesn't find are looked up by prefetch or reconcile_user
+      known = users_with_prefix(client, prefix)
+      listed = set(name.lower() for name in names)
+      purge = sorted(entry["username"] for name, entry in known.items()
+        if name not in listed and name != client.username.lower())
+    if module.params["prefetch"]:
+      rest = [name for name in names if known is None or name.lower() not in known]
+      if rest:
+        known = known or {}
+        known.update(prefetch_users(client, rest))
+  except GogsError as e:
+    module.fail_json(msg=e.msg, info=e.info, timings=client.timings())
+
+  tally = Tally()
+  results = reconcile_users(client, users, module.params["max_workers"], known,
+    cache, tally, purge)
+  cached = None
+  if cache is not None:
+    cache.save()
+    cached = cache.hits
+  summary = dict((key, tally.get(key)) for key in ("users_deleted",
+    "projects_deleted", "users_created", "projects_created"))
+
+  failed_users = sorted(name for name, res in results.items() if res.get("failed"))
+  changed_users = sorted(name for name, res in results.items() if res["changed"])
+  if failed_users:
+    module.fail_json(msg="Failed to reconcile %d of %d users: %s" %
+      (len(failed_users), len(results), ", ".join(failed_users)),
+      changed=bool(changed_users), users=results, cached=cached,
+      summary=summary, timings=client.timings())
+  if changed_users:
+    result = "Changed %d of %d users: %s" % (len(changed_users), len(results),
+      ", ".join(changed_users))
+    if summary["users_deleted"] or summary["projects_deleted"]:
+      result = "Deleted %(users_deleted)d users and %(projects_deleted)d " \
+        "projects, created %(users_created)d users and %(projects_created)d " \
+        "projects. " % summary + result
+    module.exit_json(changed=True, users=results, result=result, cached=cached,
+      summary=summary, timings=client.timings())
   else:
-    module.exit_json(changed=False)
+    module.exit_json(changed=False, users=results, cached=cached,
+      summary=summary, timings=client.timings())
 
 if __name__ == '__main__':
   main()
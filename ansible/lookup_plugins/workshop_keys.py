@@ -0,0 +1,67 @@
+# Collects the SSH public keys of the workshop clients, as read by the slurp
+# module into a registered variable, into a users list for gogs_user.
+#
+# Usage (terms are client host names):
+#
+#   users: "{{ lookup('workshop_keys', groups['client'], wantlist=True) }}"
+#
+# Options:
+#   key_var   name of the variable the slurp result is registered in on each
+#             client (default: workshop_key)
+#   user_var  name of the host variable holding the client's workshop user
+#             name (default: workshop_user)
+#   users     only include these workshop users (default: all)
+#   domain    domain of the users' email addresses (default:
+#             localhost.localdomain)
+#
+# Clients without a key (e.g. unreachable ones, or the slurp failed) are
+# skipped. The keys never touch the controller's disk.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import base64
+
+from ansible.errors import AnsibleError
+from ansible.plugins.lookup import LookupBase
+
+
+class LookupModule(LookupBase):
+
+  def run(self, terms, variables=None, **kwargs):
+    key_var = kwargs.get("key_var", "workshop_key")
+    user_var = kwargs.get("user_var", "workshop_user")
+    wanted = kwargs.get("users")
+    domain = kwargs.get("domain", "localhost.localdomain")
+    if wanted is not None:
+      wanted = set(wanted)
+    hostvars = (variables or {}).get("hostvars", {})
+
+    # lookup('workshop_keys', groups['client']) passes the list as one term
+    clients = []
+    for term in terms:
+      clients.extend(term if isinstance(term, (list, tuple)) else [term])
+
+    users = []
+    hosts = {}
+    for host in clients:
+      if host not in hostvars:
+        raise AnsibleError("workshop_keys: unknown host %s" % host)
+      host_vars = hostvars[host]
+      result = host_vars.get(key_var)
+      name = host_vars.get(user_var)
+      if not name or not isinstance(result, dict) or result.get("failed") or \
+          result.get("skipped") or not result.get("content"):
+        continue
+      if wanted is not None and name not in wanted:
+        continue
+      if name in hosts:
+        raise AnsibleError("workshop_keys: clients %s and %s are both workshop "
+          "user %s" % (hosts[name], host, name))
+      hosts[name] = host
+      try:
+        key = base64.b64decode(result["content"]).decode("utf-8").strip()
+      except (TypeError, ValueError) as e:
+        raise AnsibleError("workshop_keys: invalid key of %s: %s" % (host, e))
+      users.append({"name": name, "email": "%s@%s" % (name, domain), "key": key})
+    return users
@@ -0,0 +1,1086 @@
+# Shared code for the Gogs modules (gogs_user, gogs_project, gogs_org,
+# gogs_ready).
+
+import base64
+import binascii
+import codecs
+import fcntl
+import hashlib
+import json
+import os
+import random
+import re
+import shlex
+import shutil
+import socket
+import ssl
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+from multiprocessing.pool import ThreadPool
+
+try:
+  import httplib
+  from urllib import getproxies, proxy_bypass, quote, unquote
+  from urlparse import urlparse
+except ImportError:
+  import http.client as httplib
+  from urllib.parse import quote, unquote, urlparse
+  from urllib.request import getproxies, proxy_bypass
+
+
+# Responses of an overloaded server (nginx answers 502/504 when Gogs doesn't
+# respond); requests failing with these, or failing to connect, are retried
+RETRY_STATUS = (429, 502, 503, 504)
+# POST isn't idempotent, so it is only retried if Gogs didn't get to process
+# it; 504 means a proxy gave up waiting while Gogs may still be working on it
+# (e.g. cloning for /repos/migrate), and the retry would fail with "already
+# exists"
+RETRY_STATUS_POST = (429, 502, 503)
+RETRY_MAX = 8
+# exponential backoff between retries, in seconds
+RETRY_DELAY_MIN = 0.5
+RETRY_DELAY_MAX = 30
+# longest pause we accept from a Retry-After header
+RETRY_AFTER_MAX = 120
+# longest pause between polls of GogsClient.wait_ready, so we notice soon
+# after Gogs is up
+READY_DELAY_MAX = 4
+
+# POST requests don't reuse connections idle for longer than this (seconds):
+# if the server closed one meanwhile, a failure after sending leaves open
+# whether it got the request, and a POST can't safely be sent again
+POST_IDLE_MAX = 2
+
+# page size for list endpoints (see GogsClient.iterate)
+PAGE_LIMIT = 50
+
+LINK_RE = re.compile(r'<([^>]*)>\s*;\s*rel="?([^",;]+)"?')
+
+# concurrent pushes over one SSH connection; sshd allows 10 sessions per
+# connection by default (MaxSessions)
+SSH_MAX_SESSIONS = 8
+# seconds the shared SSH connection stays open after the last push
+SSH_PERSIST = 30
+
+
+class GogsError(Exception):
+  """
+  Raised when the Gogs server rejects a request or returns something we can't
+  handle. `info` is the info dict of the failed request, if any.
+  """
+  def __init__(self, msg, info=None):
+    Exception.__init__(self, msg)
+    self.msg = msg
+    self.info = info
+
+
+KEY_TYPE_RE = re.compile(r"^(ssh|ecdsa|sk)-[-@.a-z0-9]+$")
+
+
+def ssh_key_fingerprint(key):
+  """
+  Returns the fingerprint of an SSH public key in authorized_keys format, as
+  "<type> SHA256:<hash>" (like ssh-keygen -l). Options and the comment of the
+  key as well as whitespace don't affect the result, so the fingerprint can be
+  used to check whether two keys are the same. Raises GogsError if the key
+  can't be parsed.
+  """
+  fields = key.split()
+  for i, field in enumerate(fields[:-1]):
+    if not KEY_TYPE_RE.match(field):
+      continue
+    try:
+      blob = base64.b64decode(fields[i + 1].encode("ascii"))
+      # the blob starts with the key type, as a length-prefixed string
+      length = struct.unpack(">I", blob[:4])[0]
+      blob_type = blob[4:4 + length].decode("ascii")
+    except (TypeError, ValueError, binascii.Error, struct.error):
+      break
+    if blob_type != field:
+      break
+    digest = base64.b64encode(hashlib.sha256(blob).digest()).decode("ascii")
+    return "%s SHA256:%s" % (field, digest.rstrip("="))
+  raise GogsError("Invalid SSH public key: %s" % key)
+
+
+def diff_keys(existing, desired):
+  """
+  Compare the SSH keys on the server with the desired ones by fingerprint.
+
+  `existing` is the list of key entries returned by the Gogs API (dicts with
+  id, title and key), `desired` a list of (title, key) tuples.
+
+  Returns a tuple (missing, extra), where `missing` is the list of desired
+  (title, key) tuples not present on the server, and `extra` is the list of
+  entries on the server which are not desired.
+  """
+  index = {}
+  for entry in existing:
+    try:
+      index[ssh_key_fingerprint(entry["key"])] = entry
+    except GogsError:
+      # shouldn't happen, but we can still remove it
+      index[entry["key"].strip()] = entry
+
+  wanted = set()
+  missing = []
+  for title, key in desired:
+    fingerprint = ssh_key_fingerprint(key)
+    if fingerprint in wanted:
+      continue
+    wanted.add(fingerprint)
+    if fingerprint not in index:
+      missing.append((title, key))
+  extra = [entry for fingerprint, entry in index.items() if fingerprint not in wanted]
+  return missing, extra
+
+
+def desired_keys(sshkey_name, sshkey_file, sshkeys):
+  """
+  Returns the list of (title, key) tuples described by the sshkey_name,
+  sshkey_file and sshkeys parameters of a module. Items of `sshkeys` are either
+  keys, which are titled after the key comment (if any) or `sshkey_name`, or
+  dicts with `name` and `key`.
+  """
+  keys = []
+  if sshkey_file:
+    keys.append((sshkey_name, sshkey_file))
+  for item in sshkeys or []:
+    if isinstance(item, dict):
+      if not item.get("key"):
+        raise GogsError("Entry in sshkeys without key: %s" % item)
+      title, key = item.get("name"), item["key"]
+    else:
+      title, key = None, item
+    if not title:
+      fields = key.split()
+      if len(fields) > 2:
+        title = " ".join(fields[2:])
+      else:
+        title = "%s-%d" % (sshkey_name or "key", len(keys) + 1)
+    keys.append((title, key))
+  # make sure the keys can be parsed before we change anything
+  for title, key in keys:
+    ssh_key_fingerprint(key)
+  return keys
+
+
+def map_concurrently(func, items, max_workers):
+  """
+  Returns the list of `func(item)` for each of `items`, in order, calling
+  `func` from up to `max_workers` concurrent threads.
+  """
+  if max_workers == 1 or len(items) <= 1:
+    return [func(item) for item in items]
+  pool = ThreadPool(min(max_workers, len(items)))
+  try:
+    return pool.map(func, items)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def reconcile_all(func, items, max_workers):
+  """
+  Call `func` for each of `items`, using up to `max_workers` concurrent
+  threads. `func` returns a tuple (changed, result) like reconcile_user.
+
+  Returns a list with a result dict for each item. Failures don't abort the
+  other items; instead, the result of the failed item has `failed` set, with
+  the error message in `msg`.
+  """
+  def worker(item):
+    try:
+      changed, result = func(item)
+      return dict(changed=changed, result=" ".join(result))
+    except GogsError as e:
+      return dict(changed=False, failed=True, msg=e.msg, info=e.info)
+    except Exception as e:
+      return dict(changed=False, failed=True, msg="%s: %s" % (type(e).__name__, e))
+
+  return map_concurrently(worker, items, max_workers)
+
+
+class Tally(object):
+  """
+  Counters which may be incremented from the threads of reconcile_all, to
+  summarize what a bulk operation did.
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.counts = {}
+
+  def add(self, key, n=1):
+    with self.lock:
+      self.counts[key] = self.counts.get(key, 0) + n
+
+  def get(self, key):
+    with self.lock:
+      return self.counts.get(key, 0)
+
+
+class StateCache(object):
+  """
+  Controller-side record of the desired state last applied to each object of
+  one kind ("users", "repos") on one server, so re-runs can skip objects whose
+  parameters didn't change.
+
+  Entries are keyed by object name, and hold a digest of the parameters
+  applied and a marker of the object's state on the server at that time (its
+  id and, where Gogs provides one, its update time). If `verify` is set, a
+  cached object is only skipped if the server still reports the same marker.
+  The digests are salted, as the parameters may include passwords.
+
+  Changes are written back by save(); the file is locked while doing so, to
+  merge the changes of modules running concurrently.
+  """
+
+  def __init__(self, path, server_url, kind, verify=True, invalidate=False):
+    self.path = os.path.expanduser(path)
+    self.server_url = server_url
+    self.kind = kind
+    self.verify = verify
+    self.invalidate = invalidate
+    self.hits = 0
+    self._lock = threading.Lock()
+    self._updates = {}
+    data = self._load()
+    self.salt = data.get("salt")
+    self.entries = data.get("servers", {}).get(server_url, {}).get(kind, {})
+
+  @classmethod
+  def from_module(cls, module, kind):
+    """
+    Returns the cache configured by the cache parameters of the Gogs modules,
+    or None if caching is disabled.
+    """
+    if not module.params["cache"]:
+      return None
+    return cls(module.params["cache"], module.params["server_url"], kind,
+      verify=module.params["cache_verify"],
+      invalidate=module.params["cache_invalidate"])
+
+  def _load(self):
+    try:
+      with open(self.path) as f:
+        return json.load(f)
+    except (IOError, OSError, ValueError):
+      # missing or corrupt cache: start over
+      return {}
+
+  def digest(self, params):
+    """
+    Returns the digest of a dict of desired parameters.
+    """
+    if self.salt is None:
+      self.salt = binascii.hexlify(os.urandom(16)).decode("ascii")
+    data = self.salt + json.dumps(params, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+  def lookup(self, name, digest):
+    """
+    Returns the marker stored for object `name` if it was last reconciled with
+    parameters matching `digest`, otherwise None.
+    """
+    if self.invalidate:
+      return None
+    entry = self.entries.get(name)
+    if entry and entry.get("digest") == digest:
+      return entry.get("marker")
+    return None
+
+  def hit(self):
+    with self._lock:
+      self.hits += 1
+
+  def store(self, name, digest, marker):
+    with self._lock:
+      self._updates[name] = {"digest": digest, "marker": marker}
+
+  def forget(self, name):
+    with self._lock:
+      self._updates[name] = None
+
+  def save(self):
+    """
+    Write the entries stored or forgotten since the cache was loaded back to
+    the cache file.
+    """
+    with self._lock:
+      updates, self._updates = self._updates, {}
+    if not updates:
+      return
+    directory = os.path.dirname(self.path) or "."
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    with open(self.path + ".lock", "w") as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      data = self._load()
+      if data.get("salt") != self.salt:
+        # the file was replaced (or created) since we read it; digests with
+        # different salts can't be mixed
+        data = {"salt": self.salt}
+      entries = data.setdefault("servers", {}).setdefault(self.server_url, {}) \
+        .setdefault(self.kind, {})
+      for name, entry in updates.items():
+        if entry is None:
+          entries.pop(name, None)
+        else:
+          entries[name] = entry
+      fd, tmp = tempfile.mkstemp(dir=directory, prefix=".gogs-cache")
+      with os.fdopen(fd, "w") as f:
+        json.dump(data, f, sort_keys=True)
+      os.rename(tmp, self.path)
+
+
+def ssh_destination(url):
+  """
+  Returns the ssh arguments (port and [user@]host) for a Git URL, or None if
+  the URL doesn't use SSH.
+  """
+  if "://" in url:
+    parsed = urlparse(url)
+    if parsed.scheme not in ("ssh", "git+ssh", "ssh+git"):
+      return None
+    host = parsed.hostname
+    if parsed.username:
+      host = parsed.username + "@" + host
+    if parsed.port:
+      return ("-p", str(parsed.port), host)
+    return (host,)
+  # scp-like syntax, [user@]host:path
+  host, sep, path = url.partition(":")
+  if sep and host and "/" not in host:
+    return (host,)
+  return None
+
+
+class SeedSource(object):
+  """
+  Branches and tags of a local Git repository or bundle, to be pushed into
+  any number of projects (see the seed_source option of gogs_project). `url`
+  is the seed_url template, and `force` allows non-fast-forward pushes.
+
+  The refs are fetched once into a temporary bare repository and packed
+  there, so every push reuses the same pack instead of computing deltas
+  again. Pushes to the same SSH host share one connection (ControlMaster):
+  the first push to a host opens it, the others wait for that and then run
+  concurrently, up to SSH_MAX_SESSIONS at a time. Git only sends the refs
+  (and objects) a project doesn't have yet, so pushing again is cheap.
+  """
+
+  def __init__(self, source, url=None, force=False):
+    self.url = url
+    self.force = force
+    self.tmpdir = tempfile.mkdtemp(prefix="gogs-seed-")
+    self.git_dir = os.path.join(self.tmpdir, "seed.git")
+    self.ssh = shlex.split(os.environ.get("GIT_SSH_COMMAND", "ssh")) + [
+      "-o", "BatchMode=yes",
+      "-o", "ControlMaster=auto",
+      "-o", "ControlPath=%s" % os.path.join(self.tmpdir, "ssh-%C"),
+      "-o", "ControlPersist=%d" % SSH_PERSIST]
+    self.sessions = threading.BoundedSemaphore(SSH_MAX_SESSIONS)
+    self.lock = threading.Lock()
+    # SSH destinations, mapped to an Event set once the connection is open
+    self.connections = {}
+    try:
+      self.git("init", "--bare", "-q", self.git_dir)
+      self.git("fetch", "-q", "--no-tags", os.path.abspath(os.path.expanduser(source)),
+        "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*")
+      self.git("repack", "-a", "-d", "-q")
+      self.refs = dict(line.split(" ", 1)[::-1] for line in self.git("for-each-ref",
+        "--format=%(objectname) %(refname)", "refs/heads", "refs/tags").splitlines())
+    except GogsError:
+      shutil.rmtree(self.tmpdir, ignore_errors=True)
+      raise
+    if not self.refs:
+      shutil.rmtree(self.tmpdir, ignore_errors=True)
+      raise GogsError("No branches or tags in %s" % source)
+    self.digest = hashlib.sha256(json.dumps(sorted(self.refs.items()))
+      .encode("utf-8")).hexdigest()
+
+  def git(self, *args):
+    """
+    Run git on the seed repository; returns its output. Raises GogsError on
+    failure.
+    """
+    env = dict(os.environ, GIT_DIR=self.git_dir, GIT_TERMINAL_PROMPT="0",
+      GIT_SSH_COMMAND=" ".join(quote_shell(arg) for arg in self.ssh))
+    # a ControlMaster started by ssh keeps stderr open in the background, so
+    # it must not be a pipe we wait for
+    with open(os.devnull) as devnull, tempfile.TemporaryFile() as stderr:
+      process = subprocess.Popen(("git",) + args, env=env, cwd=self.tmpdir,
+        stdin=devnull, stdout=subprocess.PIPE, stderr=stderr)
+      output = process.communicate()[0].decode("utf-8", "replace")
+      stderr.seek(0)
+      errors = stderr.read().decode("utf-8", "replace").strip()
+    if process.returncode != 0 and not (args[0] == "push" and output):
+      raise GogsError("git %s failed: %s" % (args[0], errors or output))
+    return output
+
+  def push(self, url):
+    """
+    Push the refs which differ to `url`. Returns the list of updated refs.
+    Raises GogsError if a push fails or refs are rejected (e.g. because they
+    don't fast-forward, unless `force` was given).
+    """
+    destination = ssh_destination(url)
+    first = False
+    if destination is not None:
+      with self.lock:
+        if destination not in self.connections:
+          self.connections[destination] = threading.Event()
+          first = True
+        ready = self.connections[destination]
+      if not first:
+        ready.wait()
+
+    args = ["push", "--porcelain"]
+    if self.force:
+      args.append("--force")
+    try:
+      with self.sessions:
+        output = self.git(*(args + [url] + ["%s:%s" % (ref, ref)
+          for ref in sorted(self.refs)]))
+    finally:
+      if first:
+        ready.set()
+
+    # lines of --porcelain output are "<flag>\t<from>:<to>\t<summary>"
+    updated = []
+    rejected = []
+    for line in output.splitlines():
+      fields = line.split("\t")
+      if len(fields) < 3:
+        continue
+      to = fields[1].partition(":")[2]
+      if fields[0] in (" ", "+", "*"):
+        updated.append(to)
+      elif fields[0] == "!":
+        rejected.append("%s %s" % (to, fields[2]))
+    if rejected:
+      raise GogsError("Push to %s rejected: %s" % (url, ", ".join(rejected)))
+    return updated
+
+  def close(self):
+    """
+    Close the shared SSH connections and remove the seed repository.
+    """
+    for destination in self.connections:
+      with open(os.devnull, "w") as devnull:
+        subprocess.call(self.ssh + ["-O", "exit"] + list(destination),
+          stdin=devnull, stdout=devnull, stderr=devnull)
+    shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def quote_shell(arg):
+  """
+  Quote `arg` for a POSIX shell (pipes.quote, which is gone in Python 3.13).
+  """
+  if arg and re.match(r"^[\w@%+=:,./-]+$", arg):
+    return arg
+  return "'" + arg.replace("'", "'\"'\"'") + "'"
+
+
+def iter_json_array(read, chunk_size=16384):
+  """
+  Decode a JSON array incrementally, yielding its elements as soon as they
+  have been read completely. `read` is a function like file.read, returning
+  up to the given number of bytes, or an empty string at the end.
+
+  Raises ValueError if the data isn't a valid JSON array.
+  """
+  decoder = json.JSONDecoder()
+  utf8 = codecs.getincrementaldecoder("utf-8")()
+  state = {"buf": u"", "pos": 0, "eof": False}
+
+  def more():
+    if state["eof"]:
+      return False
+    data = read(chunk_size)
+    state["buf"] = state["buf"][state["pos"]:] + utf8.decode(data, not data)
+    state["pos"] = 0
+    state["eof"] = not data
+    return True
+
+  def next_char():
+    """
+    Skip whitespace; returns the next character, or None at the end.
+    """
+    while True:
+      buf, pos = state["buf"], state["pos"]
+      while pos < len(buf) and buf[pos] in " \t\r\n":
+        pos += 1
+      state["pos"] = pos
+      if pos < len(buf):
+        return buf[pos]
+      if not more():
+        return None
+
+  if next_char() != "[":
+    raise ValueError("Expected a JSON array")
+  state["pos"] += 1
+  if next_char() == "]":
+    return
+  while True:
+    while True:
+      try:
+        item, end = decoder.raw_decode(state["buf"], state["pos"])
+      except ValueError:
+        # incomplete element (or invalid data, if there is no more)
+        if not more():
+          raise
+        continue
+      # a number may continue in the next chunk, so the element must be
+      # followed by a delimiter
+      if end < len(state["buf"]) and state["buf"][end] in " \t\r\n,]":
+        break
+      if not more():
+        break
+    state["pos"] = end
+    yield item
+    char = next_char()
+    if char == "]":
+      return
+    if char != ",":
+      raise ValueError("Expected ',' or ']' in JSON array")
+    state["pos"] += 1
+    next_char()
+
+
+def retry_after(info):
+  """
+  Returns the delay in seconds requested by the Retry-After header in `info`
+  (either a number of seconds or an HTTP date), or None.
+  """
+  value = info.get("retry-after")
+  if not value:
+    return None
+  try:
+    delay = float(value)
+  except ValueError:
+    date = parsedate_tz(value)
+    if date is None:
+      return None
+    delay = mktime_tz(date) - time.time()
+  return min(max(delay, 0), RETRY_AFTER_MAX)
+
+
+class Throttle(object):
+  """
+  Adaptive limit on the number of concurrent requests, following the AIMD
+  scheme of TCP congestion control.
+
+  The limit starts low and doubles with every round of successful requests
+  (slow start) until the first sign of congestion; after that, it grows by
+  one per round (additive increase). It is halved (multiplicative decrease)
+  when a request fails with an overload status, fails to connect, or takes
+  much longer than the fastest recent requests to the same endpoint. Only
+  requests started after the last decrease can trigger another one, so a
+  burst of failures halves the limit just once. The limit only grows while
+  it is actually reached, i.e. not beyond the number of threads using it.
+  """
+
+  def __init__(self, max_limit=64, initial=2, latency_factor=3.0,
+      min_latency=0.05):
+    self.max_limit = max_limit
+    self.limit = float(min(initial, max_limit))
+    # a request counts as slow if it takes latency_factor times longer than
+    # the baseline of its endpoint, and longer than min_latency
+    self.latency_factor = latency_factor
+    self.min_latency = min_latency
+    self.slow_start = True
+    self.inflight = 0
+    self.baselines = {}
+    self.decreased = 0
+    self.paused_until = 0
+    self._cond = threading.Condition()
+
+  def acquire(self):
+    """
+    Wait until another request may be started; returns its start time.
+    """
+    with self._cond:
+      while True:
+        now = time.time()
+        if now < self.paused_until:
+          self._cond.wait(self.paused_until - now)
+        elif self.inflight >= int(self.limit):
+          self._cond.wait()
+        else:
+          break
+      self.inflight += 1
+      return now
+
+  def release(self, endpoint, started, status):
+    """
+    Record the outcome of a request started at `started` (as returned by
+    acquire) and adjust the limit.
+    """
+    elapsed = time.time() - started
+    with self._cond:
+      limited = self.inflight >= int(self.limit)
+      self.inflight -= 1
+
+      baseline = self.baselines.get(endpoint)
+      slow = baseline is not None and \
+        elapsed > max(self.min_latency, self.latency_factor * baseline)
+      if status >= 0 and status not in RETRY_STATUS:
+        # follow the fastest responses, but adapt slowly if they get slower
+        self.baselines[endpoint] = elapsed if baseline is None else \
+          min(elapsed, baseline + (elapsed - baseline) * 0.05)
+
+      if status < 0 or status in RETRY_STATUS or slow:
+        if started >= self.decreased:
+          self.limit = max(1.0, self.limit / 2)
+          self.decreased = time.time()
+          self.slow_start = False
+      elif limited and self.limit < self.max_limit:
+        self.limit = min(float(self.max_limit),
+          self.limit + (1.0 if self.slow_start else 1.0 / self.limit))
+      self._cond.notify_all()
+
+  def pause(self, delay):
+    """
+    Don't start any requests during the next `delay` seconds.
+    """
+    with self._cond:
+      self.paused_until = max(self.paused_until, time.time() + delay)
+      self._cond.notify_all()
+
+
+class ResponseStream(object):
+  """
+  Body of a response which is read incrementally (see GogsClient.request).
+  Closing the stream returns the connection to the pool if the body was read
+  completely; otherwise, the connection is closed, as the rest of the body
+  would have to be read before it could be reused.
+  """
+
+  def __init__(self, client, conn, resp, timing, started):
+    self.client = client
+    self.conn = conn
+    self.resp = resp
+    self.timing = timing
+    self.started = started
+
+  def read(self, size):
+    data = self.resp.read(size)
+    self.timing["bytes"] += len(data)
+    return data
+
+  def close(self):
+    if self.conn is None:
+      return
+    if self.resp.isclosed() and not self.resp.will_close:
+      self.client._release(self.conn)
+    else:
+      self.conn.close()
+    self.conn = None
+    self.timing["time"] = round(time.time() - self.started, 6)
+
+
+class GogsClient(object):
+  """
+  Minimal client for the Gogs REST API.
+
+  In contrast to fetch_url, which opens a new connection (including a TLS
+  handshake for https) for every request, the client keeps a pool of
+  HTTP/1.1 keep-alive connections to the server and reuses them for all
+  requests made during a module run. It is safe to use from multiple threads;
+  each thread takes its own connection from the pool.
+
+  The number of concurrent requests is limited by a Throttle, which adapts it
+  to what the server sustains. Requests failing because the server is
+  overloaded are retried with exponential backoff, or after the delay
+  requested by the server with Retry-After.
+
+  Like fetch_url, the client goes through the proxy given in the http_proxy
+  or https_proxy environment variable (unless no_proxy excludes the server
+  or `use_proxy` is disabled), and authenticates with a TLS client
+  certificate if `client_cert` is given.
+  """
+
+  def __init__(self, server_url, username, password, timeout=30,
+      validate_certs=True, use_proxy=True, client_cert=None, client_key=None,
+      http_agent=None, force=False):
+    url = urlparse(server_url)
+    if url.scheme not in ("http", "https"):
+      raise GogsError("Unsupported protocol in server_url: %s" % server_url)
+    self.server_url = server_url
+    self.username = username
+    self.scheme = url.scheme
+    self.netloc = url.netloc
+    self.host = url.hostname
+    self.port = url.port
+    self.base_path = url.path.rstrip("/") + "/"
+    self.timeout = timeout
+    self.validate_certs = validate_certs
+    self.client_cert = client_cert
+    self.client_key = client_key
+
+    credentials = "%s:%s" % (username, password)
+    self.headers = {
+      "Accept": "application/json",
+      "Authorization": "Basic " +
+        base64.b64encode(credentials.encode("utf-8")).decode("ascii"),
+    }
+    if http_agent:
+      self.headers["User-Agent"] = http_agent
+    if force:
+      self.headers["Cache-Control"] = "no-cache"
+
+    self.proxy = None
+    self.proxy_headers = {}
+    proxy = getproxies().get(self.scheme) if use_proxy else None
+    if proxy and not proxy_bypass(self.host):
+      self.proxy = urlparse(proxy if "://" in proxy else "http://" + proxy)
+      if self.proxy.scheme != "http":
+        raise GogsError("Unsupported protocol of proxy: %s" % proxy)
+      if self.proxy.username:
+        credentials = "%s:%s" % (unquote(self.proxy.username),
+          unquote(self.proxy.password or ""))
+        self.proxy_headers["Proxy-Authorization"] = "Basic " + \
+          base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+
+    self._lock = threading.Lock()
+    self._idle = []
+    self._created = time.time()
+    self._timings = []
+    self.throttle = Throttle()
+
+  @classmethod
+  def from_module(cls, module):
+    """
+    Create a client from the usual connection parameters of the Gogs modules
+    (including those of url_argument_spec).
+    """
+    params = module.params
+    if params.get("use_gssapi"):
+      raise GogsError("use_gssapi is not supported by the Gogs modules")
+    return cls(params["server_url"], params["url_username"],
+      params["url_password"], timeout=params["timeout"],
+      validate_certs=params.get("validate_certs", True),
+      use_proxy=params.get("use_proxy", True),
+      client_cert=params.get("client_cert"), client_key=params.get("client_key"),
+      http_agent=params.get("http_agent"), force=params.get("force", False))
+
+  def _connect(self):
+    if self.scheme == "https":
+      if self.validate_certs:
+        context = ssl.create_default_context()
+      else:
+        context = ssl._create_unverified_context()
+      if self.client_cert:
+        context.load_cert_chain(self.client_cert, self.client_key)
+      if self.proxy is None:
+        return httplib.HTTPSConnection(self.host, self.port,
+          timeout=self.timeout, context=context)
+      # TLS to the server, through a CONNECT tunnel of the proxy
+      conn = httplib.HTTPSConnection(self.proxy.hostname, self.proxy.port or 80,
+        timeout=self.timeout, context=context)
+      conn.set_tunnel(self.host, self.port, headers=self.proxy_headers)
+      return conn
+    if self.proxy is not None:
+      # plain HTTP requests are sent to the proxy with the full URL
+      return httplib.HTTPConnection(self.proxy.hostname, self.proxy.port or 80,
+        timeout=self.timeout)
+    return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+  def _acquire(self, max_idle=None):
+    """
+    Returns a tuple (connection, reused). Idle connections unused for more
+    than `max_idle` seconds are closed rather than reused.
+    """
+    stale = []
+    try:
+      with self._lock:
+        while self._idle:
+          conn, released = self._idle.pop()
+          if max_idle is None or time.time() - released <= max_idle:
+            return conn, True
+          stale.append(conn)
+    finally:
+      for conn in stale:
+        conn.close()
+    return self._connect(), False
+
+  def _release(self, conn):
+    with self._lock:
+      self._idle.append((conn, time.time()))
+
+  def timings(self):
+    """
+    Returns the timing information of all requests made so far, to be included
+    in the module result (see the gogs_timings callback plugin): `elapsed` is
+    the time since the client was created, and `requests` a list of dicts with
+    method, path (template, as passed to request), status, bytes (of the
+    response) and time (in seconds) of each request.
+    """
+    with self._lock:
+      requests = list(self._timings)
+    return {"elapsed": round(time.time() - self._created, 6), "requests": requests}
+
+  def close(self):
+    """
+    Close all idle connections.
+    """
+    with self._lock:
+      idle, self._idle = self._idle, []
+    for conn, _ in idle:
+      conn.close()
+
+  def wait_ready(self, timeout):
+    """
+    Poll the API until Gogs answers, for up to `timeout` seconds, with
+    exponential backoff (between RETRY_DELAY_MIN and READY_DELAY_MAX). Right
+    after Gogs was (re)started, connections are refused, or nginx answers in
+    its place with 502.
+
+    We request the login user's profile, which is cheap and also checks the
+    credentials. Returns the number of requests made. Raises GogsError if
+    Gogs doesn't answer with JSON in time, or rejects the credentials.
+    """
+    deadline = time.time() + timeout
+    delay = RETRY_DELAY_MIN
+    attempts = 0
+    while True:
+      attempts += 1
+      info, response = self.request("GET", "api/v1/user",
+        timeout=max(0.1, min(self.timeout, deadline - time.time())), retries=0)
+      if info["status"] == 200 and isinstance(response, dict):
+        return attempts
+      if info["status"] in (401, 403):
+        raise GogsError("Gogs rejected the login: %s" % info["msg"], info)
+      if time.time() >= deadline:
+        raise GogsError("Gogs not ready after %d seconds: %s" %
+          (timeout, info["msg"]), info)
+      time.sleep(max(0, min(delay, deadline - time.time())))
+      delay = min(delay * 2, READY_DELAY_MAX)
+
+  def iterate(self, path, args=(), limit=PAGE_LIMIT):
+    """
+    Generator over the items of a list endpoint, following its pagination.
+
+    `path` and `args` are as for request(); the page and limit parameters are
+    added to the query. Pages are requested one after the other as the items
+    are consumed, and each page is decoded while it is being received. If the
+    caller stops early (or closes the generator), the rest of the current
+    page isn't read, and no further pages are requested.
+
+    The next page is requested as long as the Link header of the response
+    has a "next" relation. Without a Link header, we go on while pages are
+    full (and the total count from X-Total-Count, if any, isn't reached yet).
+    Endpoints which don't paginate (most of them, in Gogs) return more items
+    than the limit, or, if they ignore just the page parameter, the same first
+    item again.
+
+    Raises GogsError if a request fails.
+    """
+    path += ("&" if "?" in path else "?") + "page=%s&limit=%s"
+    page = 1
+    previous = None
+    total = 0
+    while True:
+      info, response = self.request("GET", path, tuple(args) + (page, limit),
+        stream=True)
+      if info["status"] != 200:
+        raise GogsError(info["msg"], info)
+      count = 0
+      first = None
+      try:
+        for item in iter_json_array(response.read):
+          if count == 0:
+            if page > 1 and item == previous:
+              return
+            first = item
+          count += 1
+          yield item
+      except (httplib.HTTPException, socket.error, ValueError) as e:
+        raise GogsError("Failed to read %s: %s" % (info["url"], e), info)
+      finally:
+        response.close()
+      total += count
+
+      link = info.get("link")
+      if link:
+        if "next" not in [rel for url, rel in LINK_RE.findall(link)]:
+          return
+      elif count != limit or (info.get("x-total-count") and
+          total >= int(info["x-total-count"])):
+        return
+      previous = first
+      page += 1
+
+  def find(self, path, args=(), predicate=bool):
+    """
+    Returns the first item of a list endpoint (see iterate) for which
+    `predicate` is true, or None. Stops reading once it has been found.
+    """
+    items = self.iterate(path, args)
+    try:
+      for item in items:
+        if predicate(item):
+          return item
+      return None
+    finally:
+      items.close()
+
+  def request(self, method, path, args=(), body=None, stream=False, timeout=None,
+      retries=RETRY_MAX):
+    """
+    Generic REST API wrapper.
+
+    `method` is the HTTP method (GET/POST/PATCH/PUT/DELETE)
+
+    `path` is the resource path, relative to `server_url`. It may contain %s
+    placeholders, which are replaced by the URL-quoted elements of `args`.
+
+    `body` is the request body for POST/PATCH, as a Python dict/list. It will be
+    converted to JSON before sending to the server.
+
+    If `stream` is set, the body of a successful (200) response isn't read;
+    `response` is a ResponseStream instead, which must be closed after use.
+
+    `timeout` overrides the client's timeout (in seconds) for this request. If
+    the response doesn't arrive in time, the request isn't retried, as the
+    server may still be processing it; `info` has `timed_out` set then.
+
+    Returns a tuple (info, response), where `info` is a dict with the HTTP
+    status code (-1 if the request failed before a response was received) in
+    `status`, a message in `msg` and the (lowercase) response headers, and
+    `response` is the decoded JSON response (or None, for empty responses).
+    If the request had to be retried, `info` has the number of retries in
+    `retries`; after `retries` retries, the last failure is returned. POST
+    requests are only retried if they can't have reached Gogs (see
+    RETRY_STATUS_POST); failing to connect counts as such, losing the
+    connection after sending the request doesn't. Neither is a POST resent
+    on a fresh connection if a reused keep-alive one fails after sending it
+    (other requests are); POSTs only reuse connections idle for at most
+    POST_IDLE_MAX seconds, which the server is unlikely to have closed.
+    """
+    url_path = self.base_path + path % tuple(
+      quote((u"%s" % arg).encode("utf-8"), safe="") for arg in args)
+
+    data = None
+    headers = dict(self.headers)
+    if body:
+      data = json.dumps(body).encode("utf-8")
+      headers["Content-Type"] = "application/json"
+
+    info = {"url": "%s://%s%s" % (self.scheme, self.netloc, url_path)}
+    info["request_body"] = body
+    if body and "password" in body:
+      info["request_body"] = dict(body, password="********")
+
+    for attempt in range(retries + 1):
+      started = self.throttle.acquire()
+      status = -1
+      try:
+        result, response, size = self._request(method, url_path, data, headers,
+          dict(info), stream, timeout)
+        status = result["status"]
+      finally:
+        self.throttle.release(path, started, status)
+      timing = {"method": method, "path": path, "status": status,
+        "bytes": size, "time": round(time.time() - started, 6)}
+      with self._lock:
+        self._timings.append(timing)
+      if isinstance(response, tuple):
+        # the stream updates the timing when it's done
+        response = ResponseStream(self, response[0], response[1], timing, started)
+      if method == "POST":
+        retry = status in RETRY_STATUS_POST or (status < 0 and not result.get("sent"))
+      else:
+        retry = status < 0 or status in RETRY_STATUS
+      if not retry or attempt == retries or result.get("timed_out"):
+        break
+
+      delay = retry_after(result)
+      if delay is not None:
+        self.throttle.pause(delay)
+      else:
+        delay = min(RETRY_DELAY_MAX, RETRY_DELAY_MIN * 2 ** attempt)
+        time.sleep(delay * random.uniform(0.5, 1.0))
+    if attempt:
+      result["retries"] = attempt
+    return result, response
+
+  def _request(self, method, url_path, data, headers, info, stream=False,
+      timeout=None):
+    """
+    Performs the request for request(); returns a tuple (info, response, size
+    of response body). For a successful response to a `stream` request,
+    `response` is a tuple (connection, HTTPResponse) instead, with the body
+    still to be read.
+
+    If no response was received, `info` has `sent` set if the request may
+    have reached the server.
+    """
+    while True:
+      conn, reused = self._acquire(POST_IDLE_MAX if method == "POST" else None)
+      sent = waiting = False
+      try:
+        if conn.sock is None:
+          conn.connect()
+          # http.client sends headers and body in separate segments; without
+          # TCP_NODELAY, the body waits for the server's delayed ACK
+          conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.sock.settimeout(self.timeout if timeout is None else timeout)
+        sent = True
+        if self.proxy is not None and self.scheme == "http":
+          conn.request(method, "http://" + self.netloc + url_path, data,
+            dict(headers, **self.proxy_headers))
+        else:
+          conn.request(method, url_path, data, headers)
+        waiting = True
+        resp = conn.getresponse()
+        if stream and resp.status == 200:
+          info.update(dict((k.lower(), v) for k, v in resp.getheaders()))
+          info.update(status=resp.status, msg="OK (streamed)")
+          return info, (conn, resp), 0
+        content = resp.read()
+      except (httplib.HTTPException, socket.error) as e:
+        conn.close()
+        if timeout is not None and isinstance(e, socket.timeout):
+          info.update(status=-1, timed_out=True,
+            msg="Request timed out after %s seconds" % timeout)
+          return info, None, 0
+        # the server may have closed an idle keep-alive connection; try again
+        # on another one. A timeout means it did get the request, though, and
+        # a POST may have been processed once it was sent completely.
+        if reused and not isinstance(e, socket.timeout) and \
+            (method != "POST" or not waiting):
+          continue
+        info.update(status=-1, sent=sent, msg="Request failed: %s" % e)
+        return info, None, 0
+      break
+
+    if resp.will_close:
+      conn.close()
+    else:
+      self._release(conn)
+
+    info.update(dict((k.lower(), v) for k, v in resp.getheaders()))
+    info["status"] = resp.status
+    if resp.status < 400:
+      info["msg"] = "OK (%d bytes)" % len(content)
+    else:
+      info["msg"] = "HTTP Error %d: %s" % (resp.status, resp.reason)
+
+    if not content:
+      return info, None, 0
+    try:
+      response = json.loads(content.decode("utf-8"))
+    except ValueError:
+      info["body"] = content
+      return info, None, len(content)
+    # Gogs explains errors in the message field of the response
+    if resp.status >= 400 and isinstance(response, dict) and response.get("message"):
+      info["msg"] += " (%s)" % response["message"]
+    return info, response, len(content)